@@ -24,6 +24,4 @@ if __name__ == '__main__':
         server = uvicorn.Server(config)
         server.run()
     except KeyboardInterrupt:
-        pass
-        # TODO:
-        # app.shutdown()
+        pass  # the bot is stopped on ASGI lifespan shutdown
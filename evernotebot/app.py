@@ -1,11 +1,11 @@
-import asyncio
-import atexit
 import json
 import logging
+from typing import List
 
 from evernotebot import EvernoteBot
 from evernotebot.config import load_config
 from evernotebot.util.asgi import AsgiApplication
+from evernotebot.util.metrics import Family
 from evernotebot.views import evernote_oauth, set_webhook, telegram_hook
 
 
@@ -21,10 +21,18 @@ class EvernoteBotApplication(AsgiApplication):
             ('POST', f'^/{bot_api_token}$', telegram_hook),  # webhook_url
             ('GET', r'^/evernote/oauth$', evernote_oauth),  # oauth_callback_url
         )
-        super().__init__(url_schema)
-        atexit.register(self.shutdown)
+        super().__init__(url_schema, max_body_size=config['max_request_body_size'],
+                         metrics_path=config['metrics_path'])
         self.bot = EvernoteBot(config)
-        logging.getLogger('evernotebot').info(json.dumps(self.config, indent=4))
+        logger = logging.getLogger('evernotebot')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(self.config))
 
-    def shutdown(self):
-        asyncio.run(self.bot.stop())
+    def collect_metrics(self) -> List[Family]:
+        return self.bot.metrics()
+
+    async def on_startup(self):
+        await self.bot.start()
+
+    async def on_shutdown(self):
+        await self.bot.stop()
@@ -1,8 +1,9 @@
 import logging
 import traceback
-from time import time
-from typing import Optional
+from time import perf_counter, time
+from typing import List, Optional
 
+from evernotebot.bot.context import current_context, update_context
 from evernotebot.bot.errors import EvernoteBotException
 from evernotebot.bot.mixins import (
     HelpCommandMixin,
@@ -11,7 +12,18 @@ from evernotebot.bot.mixins import (
     SwitchModeCommand,
     SwitchNotebookCommand
 )
-from evernotebot.storage import Storage
+from evernotebot.bot.mixins.base import stage_duration
+from evernotebot.bot.polling import UpdatePoller
+from evernotebot.bot.queue import UpdateQueue
+from evernotebot.bot.workers import WorkerPool
+from evernotebot.storage import AsyncStorage
+from evernotebot.util.metrics import Family, add_labels, registry, stats_families
+
+
+update_duration = registry.histogram(
+    'evernotebot_update_duration_seconds', 'Time of update processing', labels=('type',))
+updates_total = registry.counter(
+    'evernotebot_updates_total', 'Processed updates by result', labels=('result',))
 
 
 def parse_command(message: dict) -> Optional[str]:
@@ -40,14 +52,73 @@ class EvernoteBot(
         self.debug = config['debug']
         self.logger = logging.getLogger('evernotebot')
         storage_config = config['storage']
-        self.failed_updates = Storage('failed_updates', storage_config)
+        self.failed_updates = AsyncStorage('failed_updates', storage_config)
+        queue_config = config.get('queue', {})
+        self.updates = UpdateQueue(self.process_update, **queue_config)
+        self.workers: Optional[WorkerPool] = None
+        if config.get('processes', 1) > 1:
+            # Updates are processed by worker processes, this one only routes them
+            max_pending = queue_config.get('max_size', 1000)
+            self.workers = WorkerPool(config, config['processes'], max_pending=max_pending)
+        handler = self.workers.process_update if self.workers else self.process_update
+        self.polling = config['telegram'].get('updates_mode') == 'polling'
+        self.poller = UpdatePoller(self.api, handler, **config['telegram'].get('polling', {}))
+
+    async def start(self):
+        await self.api.connect()
+        await self.exec_all_mixins('on_bot_start')
+        if self.workers:
+            await self.workers.start()
+        if self.polling:
+            await self.poller.start()
 
     async def stop(self):
+        await self.poller.stop()
+        if self.workers:
+            await self.workers.stop()
+        await self.updates.stop()
         await self.exec_all_mixins('on_bot_stop')
-        self.failed_updates.close()
+        await self.failed_updates.close()
+        await self.api.close()
+
+    def enqueue_update(self, update: dict):
+        if self.workers:
+            self.workers.put_update(update)
+        else:
+            self.updates.put(update)
+
+    @property
+    def stats(self) -> dict:
+        stats = {
+            'telegram_api': self.api.pool_stats,
+            'queue': self.updates.stats,
+            'evernote_executor': self.evernote_executor.stats,
+            'evernote_clients': self._evernote_clients.stats,
+            'tmp_files': self.tmp_files.stats,
+            'files_cache': self.files_cache.stats,
+        }
+        if self.polling:
+            stats['polling'] = self.poller.stats
+        if self.workers:
+            stats['workers'] = self.workers.stats
+        return stats
+
+    def metrics(self) -> List[Family]:
+        families = registry.collect() + stats_families('evernotebot', self.stats)
+        if self.workers:
+            for index, worker_families in self.workers.metrics.items():
+                families.extend(add_labels(worker_families, worker=index))
+        return families
 
     async def process_update(self, update: dict):
+        with update_context():
+            await self._process_update(update)
+
+    async def _process_update(self, update: dict):
         self.logger.debug(update)
+        started = perf_counter()
+        update_type = next((key for key in update if key != 'update_id'), 'unknown')
+        result = 'processed'
         try:
             await self.exec_all_mixins('on_bot_update', update)
             if 'message' in update:
@@ -61,21 +132,44 @@ class EvernoteBot(
             else:
                 self.logger.warning('update is ignored: {0}'.format(str(update)))
         except EvernoteBotException as e:
+            result = 'error'  # reported to the user
             self.logger.error(f'{traceback.format_exc()} {e}')
-            await self.send_message(f'\u274c Error. {e}')
+            try:
+                await self.send_message(f'\u274c Error. {e}')
+            except Exception:
+                self.logger.error(f'Failed to report an error to the user: {traceback.format_exc()}')
         except Exception:
-            self.logger.error(traceback.format_exc())
-            self.failed_updates.create({
-                'created': time(),
-                'update_data': update,
-                'exception': traceback.format_exc(),
-            })
+            result = 'failed'
+            exception = traceback.format_exc()
+            self.logger.error(exception)
+            try:
+                await self.failed_updates.create({
+                    'created': time(),
+                    'update_data': update,
+                    'exception': exception,
+                })
+            except Exception:
+                self.logger.error(f'Failed to save a failed update: {traceback.format_exc()}')
         finally:
             await self.exec_all_mixins('on_bot_update_finished')
+            update_duration.observe(perf_counter() - started, type=update_type)
+            updates_total.inc(result=result)
+
+    async def oauth_callback(self, callback_key: str, access_type: str, verifier: Optional[str]):
+        if self.workers:
+            with update_context():
+                user = await self.find_user({'evernote.oauth.callback_key': callback_key})
+            await self.workers.call(user['chat_id'], 'oauth_callback', callback_key, access_type, verifier)
+            return
+        with update_context():
+            try:
+                await self.evernote_auth(callback_key, access_type, verifier)
+            except EvernoteBotException as e:
+                await self.send_message(e.message)
 
     async def receive_message(self, message: dict):
         if command_name := parse_command(message):
-            await self.exec_all_mixins('on_command', command_name)
+            await self.exec_command(command_name)
             return
         user_state = self.user.get('state')
         if user_state:
@@ -86,10 +180,15 @@ class EvernoteBot(
         for message_type in message_attrs:
             if not message.get(message_type):
                 continue
-            status_message = await self.send_message(f'{message_type.capitalize()} accepted')
+            context = current_context()
+            with stage_duration.time(stage='status_message'):
+                context.status_message = await self.send_message(f'{message_type.capitalize()} accepted')
             await self.exec_all_mixins(f'on_receive_{message_type}', message)
+            # A note saved later (see `NoteAppendBuffer`) takes the message and edits it itself
+            status_message, context.status_message = context.status_message, None
             if status_message:
-                await self.edit_message(status_message['message_id'], 'Saved')
+                with stage_duration.time(stage='status_message'):
+                    await self.edit_message(status_message['message_id'], 'Saved')
 
     async def channel_post(self, channel_post: dict):
         await self.receive_message(channel_post)
@@ -1,15 +1,24 @@
+import asyncio
 import hashlib
 import json
 import logging
+import os
 import random
 from json import JSONDecodeError
-from time import time
+from time import perf_counter, time
 from typing import Optional
 
 import aiohttp
 
+from evernotebot.util.metrics import registry
+
 
 logger = logging.getLogger('telegram.api')
+request_duration = registry.histogram(
+    'telegram_api_request_duration_seconds', 'Time of Bot API requests', labels=('method',))
+requests_total = registry.counter(
+    'telegram_api_requests_total', 'Bot API requests by result', labels=('method', 'result'))
+downloaded_bytes = registry.counter('telegram_api_downloaded_bytes_total', 'Size of downloaded files')
 
 
 class BotApiError(Exception):
@@ -22,8 +31,16 @@ class BotApiError(Exception):
         return f'{self.code} {self.message}'
 
 
+class FileTooBigError(BotApiError):
+    def __init__(self, max_size: int):
+        super().__init__(-1, f'File size exceeds {max_size} bytes')
+        self.max_size = max_size
+
+
 def log_http_request(method):
     async def wrapper(obj, url: str, params: dict):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return await method(obj, url, params)
         h = hashlib.sha256()
         h.update('{0}_{1}_{2}'.format(time(), url, random.random()).encode())  # nosec
         request_id = h.hexdigest()
@@ -45,21 +62,75 @@ def log_http_request(method):
 
 
 class BotApi:
-    def __init__(self, token: str, api_url: str):
+    def __init__(self, token: str, api_url: str, pool: Optional[dict] = None,
+                 download_chunk_size: int = 256 * 1024):
         self.token = token
         self.api_url = api_url.rstrip('/')
+        self.pool_config = pool or {}
+        self.download_chunk_size = download_chunk_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connections_created = 0
+        self._connections_reused = 0
+
+    async def connect(self) -> aiohttp.ClientSession:
+        if self._session is not None and not self._session.closed:
+            return self._session
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self.__on_connection_created)
+        trace_config.on_connection_reuseconn.append(self.__on_connection_reused)
+        connector = aiohttp.TCPConnector(
+            ssl=False,
+            limit=self.pool_config.get('limit', 100),
+            limit_per_host=self.pool_config.get('limit_per_host', 20),
+            keepalive_timeout=self.pool_config.get('keepalive_timeout', 30),
+            ttl_dns_cache=self.pool_config.get('ttl_dns_cache', 300),
+        )
+        self._session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is None:
+            return
+        if not self._session.closed:
+            await self._session.close()
+        self._session = None
+        logger.info({'type': 'pool_stats', 'stats': self.pool_stats})
+
+    @property
+    def pool_stats(self) -> dict:
+        created = self._connections_created
+        reused = self._connections_reused
+        total = created + reused
+        return {
+            'connections_created': created,
+            'connections_reused': reused,
+            'hit_ratio': total and reused / total,
+        }
+
+    async def __on_connection_created(self, session, context, params):
+        self._connections_created += 1
+
+    async def __on_connection_reused(self, session, context, params):
+        self._connections_reused += 1
 
     @log_http_request
     async def __http_post_request(self, url: str, params: dict) -> bytes:
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(verify_ssl=False)) as session:
-            async with session.post(url, json=params) as response:
-                data = await response.read()
+        session = await self.connect()
+        async with session.post(url, json=params) as response:
+            data = await response.read()
         return data
 
     async def __api_request(self, api_method: str, **kwargs) -> dict:
         url = f'{self.api_url}/bot{self.token}/{api_method}'
         request_params = {k: v for k, v in kwargs.items() if v is not None}
-        raw_response = await self.__http_post_request(url, request_params)
+        started = perf_counter()
+        try:
+            raw_response = await self.__http_post_request(url, request_params)
+        except Exception:
+            requests_total.inc(method=api_method, result='connection_error')
+            raise
+        finally:
+            request_duration.observe(perf_counter() - started, method=api_method)
         try:
             response = json.loads(raw_response.decode())
         except JSONDecodeError:
@@ -69,7 +140,9 @@ class BotApi:
                 'description': raw_response.decode(),
             }
         if not response['ok']:
+            requests_total.inc(method=api_method, result='error')
             raise BotApiError(response['error_code'], response['description'])
+        requests_total.inc(method=api_method, result='ok')
         return response['result']
 
     async def setWebhook(self, url: str, certificate=None, max_connections=40, allowed_updates=None):
@@ -83,6 +156,19 @@ class BotApi:
             allowed_updates=allowed_updates
         )
 
+    async def deleteWebhook(self, drop_pending_updates: bool = False):
+        return await self.__api_request('deleteWebhook', drop_pending_updates=drop_pending_updates)
+
+    async def getUpdates(self, offset: Optional[int] = None, limit: int = 100, timeout: int = 0,
+                         allowed_updates=None) -> list:
+        return await self.__api_request(
+            'getUpdates',
+            offset=offset,
+            limit=limit,
+            timeout=timeout,
+            allowed_updates=allowed_updates
+        )
+
     async def sendMessage(self, chat_id: int, text: str, reply_markup: Optional[str] = None, parse_mode=None) -> dict:
         return await self.__api_request(
             'sendMessage',
@@ -113,3 +199,32 @@ class BotApi:
         response = await self.__api_request('getFile', file_id=file_id)
         path = response['file_path']
         return f'{self.api_url}/file/bot{self.token}/{path}'
+
+    async def download_file(self, url: str, filepath: str, max_size: Optional[int] = None,
+                            chunk_size: Optional[int] = None) -> dict:
+        chunk_size = chunk_size or self.download_chunk_size
+        session = await self.connect()
+        loop = asyncio.get_running_loop()
+        md5 = hashlib.md5()
+        size = 0
+        with request_duration.time(method='download_file'):
+            async with session.get(url) as response:
+                if response.status != 200:
+                    raise BotApiError(response.status, f'Failed to download file: {response.reason}')
+                if max_size and response.content_length and response.content_length > max_size:
+                    raise FileTooBigError(max_size)
+                f = await loop.run_in_executor(None, open, filepath, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        size += len(chunk)
+                        if max_size and size > max_size:
+                            raise FileTooBigError(max_size)
+                        md5.update(chunk)
+                        await loop.run_in_executor(None, f.write, chunk)
+                except BaseException:
+                    await loop.run_in_executor(None, f.close)
+                    await loop.run_in_executor(None, os.unlink, filepath)
+                    raise
+                await loop.run_in_executor(None, f.close)
+        downloaded_bytes.inc(size)
+        return {'size': size, 'md5': md5.hexdigest()}
@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional
+
+
+@dataclass
+class UpdateContext:
+    user: dict = field(default_factory=dict)
+    chat: Optional[dict] = None
+    evernote_api: Any = None
+    tmp_scope: Any = None  # temporary files of the update, see `TmpFileManager`
+    status_message: Optional[dict] = None  # "... accepted" message, it's edited when the update is saved
+
+
+_update_context: ContextVar[UpdateContext] = ContextVar('update_context')
+
+
+def current_context() -> UpdateContext:
+    try:
+        return _update_context.get()
+    except LookupError:
+        context = UpdateContext()
+        _update_context.set(context)
+        return context
+
+
+@contextmanager
+def update_context() -> Iterator[UpdateContext]:
+    # Every update gets its own context, so coroutines processing different
+    # updates concurrently never see each other's user or Evernote client
+    context = UpdateContext()
+    token = _update_context.set(context)
+    try:
+        yield context
+    finally:
+        _update_context.reset(token)
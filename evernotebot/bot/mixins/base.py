@@ -1,15 +1,64 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+from evernotebot.util.metrics import registry
+
+
+stage_duration = registry.histogram(
+    'evernotebot_stage_duration_seconds', 'Time of the stages of update processing', labels=('stage',))
+
+
 class BaseMixin:
+    command: Optional[str] = None  # a bot command handled by `on_command()` of the mixin
+    _handlers: Dict[str, List[Tuple[type, Callable]]] = {}
+    _callbacks: Dict[str, List[Callable]] = {}
+    _commands: Dict[str, Callable] = {}
+
     def __init__(self, config: dict):
         self.config = config
         bot_name = config['telegram']['bot_name']
         self.url = f'https://t.me/{bot_name}'
         self.name = bot_name
 
+    def __init_subclass__(cls, **kwargs):
+        '''
+        Builds the callbacks of the class from the mixins it's made of once,
+        instead of looking them up on every update.
+        A hook overriding a hook of its parent must call it with `super()`,
+        so only the most derived one is registered.
+        '''
+        super().__init_subclass__(**kwargs)
+        handlers = {}  # callback name -> [(class defining the handler, handler)]
+        commands = {}
+        for base in cls.__bases__:
+            for name, base_handlers in getattr(base, '_handlers', {}).items():
+                handlers.setdefault(name, []).extend(base_handlers)
+            for command, handler in getattr(base, '_commands', {}).items():
+                commands.setdefault(command, handler)
+        for name, handler in vars(cls).items():
+            if name.startswith('on_') and callable(handler):
+                handlers[name] = [(cls, handler)]
+        if vars(cls).get('command') and 'on_command' in vars(cls):
+            commands[cls.command] = cls.on_command
+        for name, items in handlers.items():
+            unique = []
+            for owner, handler in items:
+                if any(o is owner for o, _ in unique):
+                    continue
+                if any(o is not owner and issubclass(o, owner) for o, _ in items):
+                    continue
+                unique.append((owner, handler))
+            handlers[name] = unique
+        cls._handlers = handlers
+        cls._callbacks = {name: [handler for _, handler in items] for name, items in handlers.items()}
+        cls._commands = commands
+
     async def exec_all_mixins(self, callback_name: str, *args):
-        for _class in self.__class__.__bases__:
-            if not hasattr(_class, callback_name):
-                continue
-            method = getattr(_class, callback_name)
+        for method in self._callbacks.get(callback_name, ()):
             out = await method(self, *args)
             if out is False:
                 break
+
+    async def exec_command(self, name: str):
+        handler = self._commands.get(name)
+        if handler is not None:
+            await handler(self, name)
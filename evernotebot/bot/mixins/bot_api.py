@@ -7,4 +7,6 @@ class BotApiMixin(BaseMixin):
         super(BotApiMixin, self).__init__(config)
         token: str = config['telegram']['token']
         bot_api_url: str = config['telegram']['api_url']
-        self.api: BotApi = BotApi(token, bot_api_url)
+        pool_config: dict = config['telegram'].get('pool')
+        chunk_size: int = config['telegram'].get('download_chunk_size', 256 * 1024)
+        self.api: BotApi = BotApi(token, bot_api_url, pool_config, download_chunk_size=chunk_size)
@@ -4,14 +4,14 @@ from evernotebot.bot.mixins.chat import ChatMixin
 
 
 class StartCommandMixin(EvernoteMixin):
+    command = 'start'
+
     async def on_command(self, name: str):
-        if name != 'start':
-            return
         text = '''Welcome! It's bot for saving your notes to Evernote on fly.
 Please tap on button below to link your Evernote account with bot.'''
         oauth_data = await self.get_evernote_oauth_data(text)
         self.user['evernote'] = {'oauth': oauth_data}
-        self.save_user()
+        await self.save_user()
 
 
 def check_user(user: dict):
@@ -25,9 +25,9 @@ def check_user(user: dict):
 
 
 class SwitchModeCommand(EvernoteMixin):
+    command = 'switch_mode'
+
     async def on_command(self, name: str):
-        if name != 'switch_mode':
-            return
         check_user(self.user)
         buttons = []
         for mode in ('one_note', 'multiple_notes'):
@@ -42,7 +42,7 @@ class SwitchModeCommand(EvernoteMixin):
         }
         await self.send_message('Please, select mode', keyboard_data=keyboard)
         self.user['state'] = 'switch_mode'
-        self.save_user()
+        await self.save_user()
 
     async def on_user_state(self, state: str, message: dict):
         if state != 'switch_mode':
@@ -63,7 +63,7 @@ class SwitchModeCommand(EvernoteMixin):
             # del self.user['evernote']['shared_note_id']
             self.user['bot_mode'] = mode
             await self.send_message(f'The bot has switched to `{title}` mode.', keyboard_data={'hide_keyboard': True})
-        self.save_user()
+        await self.save_user()
 
     async def switch_mode_one_note(self):
         settings = self.user['evernote']
@@ -72,7 +72,7 @@ class SwitchModeCommand(EvernoteMixin):
             text = 'Please, sign in and give the permissions to the bot.'
             oauth_data = await self.get_evernote_oauth_data(text, access='readwrite')
             self.user['evernote']['oauth'] = oauth_data
-            self.save_user()
+            await self.save_user()
             return
         nb_id = settings['notebook']['guid']
         note_id, note_url = await self.create_shared_note(nb_id, title='Telegram bot notes')
@@ -80,13 +80,13 @@ class SwitchModeCommand(EvernoteMixin):
         text = f'Your notes will be saved to <a href="{note_url}">this note</a>'
         await self.send_message(text, parse_mode='Html')
         self.user['bot_mode'] = 'one_note'
-        self.save_user()
+        await self.save_user()
 
 
 class SwitchNotebookCommand(EvernoteMixin):
+    command = 'notebook'
+
     async def on_command(self, name: str):
-        if name != 'notebook':
-            return
         check_user(self.user)
         all_notebooks = await self.evernote_get_notebooks()
         buttons = []
@@ -103,7 +103,7 @@ class SwitchNotebookCommand(EvernoteMixin):
         }
         await self.send_message('Please, select notebook', keyboard_data=keyboard)
         self.user['state'] = 'switch_notebook'
-        self.save_user()
+        await self.save_user()
 
     async def on_user_state(self, state: str, message: dict):
         user = self.user
@@ -114,6 +114,10 @@ class SwitchNotebookCommand(EvernoteMixin):
         if name.startswith('> ') and name.endswith(' <'):
             name = name[2:-2]
         notebooks = await self.evernote_get_notebooks({'name': name})
+        if not notebooks:
+            # The notebook may have been created after the list was cached
+            self.evernote_invalidate_notebooks()
+            notebooks = await self.evernote_get_notebooks({'name': name})
         if not notebooks:
             raise EvernoteBotException(f'Notebook `{name}` not found')
         # TODO: self.create_note(notebook) if bot_user.bot_mode == 'one_note'
@@ -121,13 +125,13 @@ class SwitchNotebookCommand(EvernoteMixin):
         user['evernote']['notebook']['name'] = notebook['name']
         user['evernote']['notebook']['guid'] = notebook['guid']
         await self.send_message(f'Current notebook: {notebook["name"]}', keyboard_data={'hide_keyboard': True})
-        self.save_user()
+        await self.save_user()
 
 
 class HelpCommandMixin(ChatMixin):
+    command = 'help'
+
     async def on_command(self, name: str):
-        if name != 'help':
-            return
         await self.send_message('''This is bot for Evernote (https://evernote.com).
 
 Just send message to bot and it will create note in your Evernote notebook.
@@ -1,9 +1,14 @@
 import logging
 from typing import Tuple
 
+from evernotebot.bot.context import current_context
 from evernotebot.bot.errors import EvernoteBotException
+from evernotebot.bot.mixins.base import stage_duration
 from evernotebot.bot.mixins.chat import ChatMixin
+from evernotebot.util.cache import LruCache
+from evernotebot.util.evernote.buffer import NoteAppendBuffer
 from evernotebot.util.evernote.client import EvernoteApi, get_oauth_data
+from evernotebot.util.evernote.executor import SdkExecutor
 
 from requests_oauthlib.oauth1_session import TokenRequestDenied
 
@@ -11,29 +16,57 @@ from requests_oauthlib.oauth1_session import TokenRequestDenied
 class EvernoteMixin(ChatMixin):
     def __init__(self, config: dict):
         super(EvernoteMixin, self).__init__(config)
-        self._evernote_api: EvernoteApi = None
+        evernote_config = config['evernote']
+        self.evernote_executor = SdkExecutor(**evernote_config.get('executor', {}))
+        cache_config = evernote_config.get('clients_cache', {})
+        self._evernote_clients = LruCache(max_size=cache_config.get('max_size', 1000), ttl=cache_config.get('ttl'))
+        self.one_note_buffer = NoteAppendBuffer(**evernote_config.get('one_note_batch', {}))
+
+    async def on_bot_stop(self):
+        await super(EvernoteMixin, self).on_bot_stop()
+        await self.one_note_buffer.close()
+        self._evernote_clients.clear()
+        await self.evernote_executor.shutdown()
 
     async def on_message(self, message: dict):
         await super(EvernoteMixin, self).on_message(message)
         token = self.user.get('evernote', {}).get('access_token')
         if not token:
             raise EvernoteBotException('You have to sign in to Evernote first. Send /start and link account')
-        self._evernote_api = EvernoteApi(token, sandbox=self.config['debug'])
+        current_context().evernote_api = self.get_evernote_api(token)
+
+    def get_evernote_api(self, token: str) -> EvernoteApi:
+        api = self._evernote_clients.get(token)
+        if api is None:
+            api = EvernoteApi(
+                token,
+                sandbox=self.config['debug'],
+                executor=self.evernote_executor,
+                user_info_ttl=self.config['evernote'].get('user_info_ttl', 3600),
+                quota_ttl=self.config['evernote'].get('quota_ttl', 300),
+                notebooks_ttl=self.config['evernote'].get('notebooks_ttl', 600)
+            )
+            self._evernote_clients.set(token, api)
+        return api
 
     @property
-    def evernote_api(self):
+    def evernote_api(self) -> EvernoteApi:
         token = self.user.get('evernote', {}).get('access_token')
         if not token:
             raise EvernoteBotException('You have to sign in to Evernote first. Send /start and link account')
-        self._evernote_api = EvernoteApi(token, sandbox=self.config['debug'])
-        return self._evernote_api
+        context = current_context()
+        if context.evernote_api is None or context.evernote_api.token != token:
+            context.evernote_api = self.get_evernote_api(token)
+        return context.evernote_api
 
     async def get_evernote_oauth_data(self, message_text: str, access: str = 'readonly') -> dict:
         auth_button = {'text': 'Waiting for Evernote...', 'url': self.url}
         status_message = await self.send_message(message_text, buttons=[auth_button])
         app_config = self.config['evernote']['access'][access]
         try:
-            oauth_data = get_oauth_data(
+            oauth_data = await self.evernote_executor.run(
+                self.user['user_id'],
+                get_oauth_data,
                 self.user['user_id'],
                 app_config['key'],
                 app_config['secret'],
@@ -52,7 +85,7 @@ class EvernoteMixin(ChatMixin):
     async def evernote_auth(self, callback_key: str, access: str, oauth_verifier: str):
         if not oauth_verifier:
             raise EvernoteBotException('We are sorry, but you have declined authorization.')
-        user = self.find_user({'evernote.oauth.callback_key': callback_key})
+        user = await self.find_user({'evernote.oauth.callback_key': callback_key})
         oauth = user['evernote']['oauth']
         app_config = self.config['evernote']['access'][access]
         try:
@@ -62,10 +95,11 @@ class EvernoteMixin(ChatMixin):
                 oauth['token'],
                 oauth['secret'],
                 oauth_verifier,
-                sandbox=self.config['debug']
+                sandbox=self.config['debug'],
+                executor=self.evernote_executor
             )
             self.user['evernote']['access_token'] = access_token
-            self._evernote_api = EvernoteApi(access_token, sandbox=self.config['debug'])
+            current_context().evernote_api = self.get_evernote_api(access_token)
         except TokenRequestDenied as e:
             logging.getLogger('evernotebot').fatal(e, exc_info=True)
             raise EvernoteBotException('Evernote access token request failed. Try again later.')
@@ -74,7 +108,7 @@ class EvernoteMixin(ChatMixin):
             raise EvernoteBotException('Getting evernote access token failed. Try again later.')
         try:
             await self.user_setup_by_access(self.user, access)
-            self.save_user()
+            await self.save_user()
         except Exception as e:
             logging.getLogger('evernotebot').fatal(e, exc_info=True)
             raise EvernoteBotException('User initial setup failed. Try again later.')
@@ -94,26 +128,52 @@ class EvernoteMixin(ChatMixin):
             await self.send_message(f'Current notebook: {nb_name}\nCurrent mode: {mode}')
 
     async def evernote_check_quota(self, file_size: int):
-        quota = await self.evernote_api.get_quota_info()
+        with stage_duration.time(stage='check_quota'):
+            quota = await self.evernote_api.get_quota_info()
         if quota['remaining'] < file_size:
             reset_date = quota['reset_date'].strftime('%Y-%m-%d %H:%M:%S')
             remain_bytes = quota['remaining']
             raise EvernoteBotException(f'Your evernote quota is out ({remain_bytes} bytes remains till {reset_date})')
 
     async def evernote_get_notebooks(self, query: dict = None) -> Tuple[dict]:
-        nbs = await self.evernote_api.get_all_notebooks(query)
+        # The list is kept in the user document, so it survives restarts.
+        # It's saved along with the next `save_user()`
+        api = self.evernote_api
+        settings = self.user['evernote']
+        if settings.get('notebooks'):
+            api.load_notebooks(settings['notebooks'])
+        nbs = await api.get_all_notebooks(query)
+        settings['notebooks'] = api.notebooks
         return tuple((nb for nb in nbs))
 
+    def evernote_invalidate_notebooks(self) -> None:
+        self.evernote_api.invalidate_notebooks()
+        self.user['evernote'].pop('notebooks', None)
+
     async def create_shared_note(self, notebook_guid: str, title):
         note_id = await self.evernote_api.create_note(notebook_guid, title=title)
-        note_url = self.evernote_api.get_note_link(note_id)
+        note_url = await self.evernote_api.get_note_link(note_id)
         return note_id, note_url
 
     async def save_note(self, text: str = None, title: str = None, **kwargs):
         user = self.user
         if user['bot_mode'] == 'one_note':
             note_id = user['evernote']['shared_note_id']
-            await self.evernote_api.update_note(note_id, text, title, **kwargs)
+            fragment = dict(kwargs, text=text, title=title)
+            chat_id = user['chat_id']
+            context = current_context()
+            status_message, context.status_message = context.status_message, None
+
+            async def on_error(e: Exception):
+                await self.api.sendMessage(chat_id, 'Failed to save some of your messages to the note. Please, try again later')
+
+            async def on_saved():
+                await self.api.editMessageText(chat_id, status_message['message_id'], 'Saved')
+
+            with stage_duration.time(stage='update_note'):  # text is only buffered here
+                await self.one_note_buffer.append(self.evernote_api, note_id, fragment, on_error=on_error,
+                                                  on_saved=on_saved if status_message else None)
         else:
             notebook_id = user['evernote']['notebook']['guid']
-            await self.evernote_api.create_note(notebook_id, text, title, **kwargs)
+            with stage_duration.time(stage='create_note'):
+                await self.evernote_api.create_note(notebook_id, text, title, **kwargs)
@@ -1,10 +1,15 @@
 import math
+import mimetypes
 from os.path import basename, join
 from urllib.parse import urlparse
 
+from evernotebot.bot.api import FileTooBigError
+from evernotebot.bot.context import current_context
 from evernotebot.bot.errors import EvernoteBotException
 from evernotebot.bot.mixins import EvernoteMixin
-from evernotebot.util.http import make_request
+from evernotebot.bot.mixins.base import stage_duration
+from evernotebot.util.file_cache import FileCache
+from evernotebot.util.tmp import TmpFileManager, TmpScope
 
 
 def get_message_text(message: dict, start: int = 0, end: int = None) -> str:
@@ -87,6 +92,32 @@ def get_telegram_link(message: dict) -> str:
 
 
 class MessageHandlerMixin(EvernoteMixin):
+    def __init__(self, config: dict):
+        super(MessageHandlerMixin, self).__init__(config)
+        self.tmp_files = TmpFileManager(config['tmp_root'], **config.get('tmp', {}))
+        self.files_cache = FileCache(join(config['tmp_root'], 'files'), **config.get('files_cache', {}))
+
+    async def on_bot_start(self):
+        await self.tmp_files.start()
+
+    async def on_bot_stop(self):
+        await super(MessageHandlerMixin, self).on_bot_stop()
+        await self.tmp_files.stop()
+
+    async def on_bot_update_finished(self):
+        # Notes are saved at this point (see `NoteAppendBuffer`), so the files aren't needed anymore
+        context = current_context()
+        if context.tmp_scope is not None:
+            context.tmp_scope.cleanup()
+            context.tmp_scope = None
+
+    @property
+    def tmp_scope(self) -> TmpScope:
+        context = current_context()
+        if context.tmp_scope is None:
+            context.tmp_scope = self.tmp_files.scope()
+        return context.tmp_scope
+
     async def on_receive_text(self, message: dict):
         html = format_html(message)
         telegram_link = get_telegram_link(message)
@@ -98,28 +129,30 @@ class MessageHandlerMixin(EvernoteMixin):
     async def on_receive_photo(self, message: dict):
         max_size = 20 * 1024 * 1024  # telegram restriction. We can't download any file that has size more than 20Mb
         file_id = None
+        file_unique_id = None
         file_size = math.inf
         for photo in message['photo']:  # pick the biggest file
             if photo['file_size'] <= max_size and \
                     (file_size == math.inf or file_size < photo['file_size']):
                 file_size = photo['file_size']
                 file_id = photo['file_id']
-        await self.save_file(file_id, file_size, message)
+                file_unique_id = photo.get('file_unique_id')
+        await self.save_file(file_id, file_size, message, file_unique_id)
 
     async def on_receive_video(self, message: dict):
         file_size = message['video']['file_size']
         file_id = message['video']['file_id']
-        await self.save_file(file_id, file_size, message)
+        await self.save_file(file_id, file_size, message, message['video'].get('file_unique_id'))
 
     async def on_receive_document(self, message: dict):
         file_size = message['document']['file_size']
         file_id = message['document']['file_id']
-        await self.save_file(file_id, file_size, message)
+        await self.save_file(file_id, file_size, message, message['document'].get('file_unique_id'))
 
     async def on_receive_voice(self, message: dict):
         file_id = message['voice']['file_id']
         file_size = message['voice']['file_size']
-        await self.save_file(file_id, file_size, message)
+        await self.save_file(file_id, file_size, message, message['voice'].get('file_unique_id'))
 
     async def on_receive_location(self, message: dict):
         latitude = message['location']['latitude']
@@ -137,13 +170,12 @@ class MessageHandlerMixin(EvernoteMixin):
         title = get_message_caption(message) or title
         await self.save_note(title=title, html=html)
 
-    async def save_file(self, file_id: str, file_size: int, message: dict):
-        download_dir = self.config['tmp_root']
-        filename, short_name = await self.download_telegram_file(file_id, file_size, download_dir)
-        await self.evernote_check_quota(file_size)
+    async def save_file(self, file_id: str, file_size: int, message: dict, file_unique_id: str = None):
+        file_info = await self.download_telegram_file(file_id, file_size, file_unique_id)
+        await self.evernote_check_quota(file_info['size'])
         message_text = message.get('text')
         title = get_message_caption(message) or (message_text and message_text[:20]) or 'File'
-        files = ({'path': filename, 'name': short_name},)
+        files = (file_info,)
         text = ''
         telegram_link = get_telegram_link(message)
         if telegram_link:
@@ -151,14 +183,32 @@ class MessageHandlerMixin(EvernoteMixin):
             text = f'<div><p><a href="{telegram_link}">{telegram_link}</a></p><pre>{caption}</pre></div>'
         await self.save_note('', title=title, files=files, html=text)
 
-    async def download_telegram_file(self, file_id: str, file_size: int, dirpath: str):
-        max_size = 20 * 1024 * 1024
-        if file_size > max_size:
-            raise EvernoteBotException('File too big. Telegram does not allow to the bot to download files over 20Mb.')
-        download_url = await self.api.getFile(file_id)
-        data = make_request(download_url)
-        short_name = basename(urlparse(download_url).path)
-        filepath = join(dirpath, f'{file_id}_{short_name}')
-        with open(filepath, 'wb') as f:
-            f.write(data)
-        return filepath, short_name
+    async def download_telegram_file(self, file_id: str, file_size: int, file_unique_id: str = None) -> dict:
+        with stage_duration.time(stage='download_file'):
+            max_size = 20 * 1024 * 1024
+            too_big_message = 'File too big. Telegram does not allow to the bot to download files over 20Mb.'
+            if file_size > max_size:
+                raise EvernoteBotException(too_big_message)
+            if file_unique_id:
+                # The same file sent again (e.g. forwarded): no `getFile` request and no download
+                file_info = self.files_cache.get(file_unique_id, self.tmp_scope.path(file_unique_id))
+                if file_info is not None:
+                    return file_info
+            download_url = await self.api.getFile(file_id)
+            short_name = basename(urlparse(download_url).path)
+            filepath = self.tmp_scope.path(f'{file_id}_{short_name}')
+            try:
+                download_info = await self.api.download_file(download_url, filepath, max_size=max_size)
+            except FileTooBigError:
+                raise EvernoteBotException(too_big_message)
+            extension = short_name.split('.')[-1]
+            file_info = {
+                'path': filepath,
+                'name': short_name,
+                'size': download_info['size'],
+                'md5': download_info['md5'],
+                'mime_type': mimetypes.types_map.get(f'.{extension}', 'application/octet-stream'),
+            }
+            if file_unique_id:
+                self.files_cache.put(file_unique_id, file_info)
+            return file_info
@@ -1,9 +1,10 @@
 from copy import copy
 from time import time
 
+from evernotebot.bot.context import current_context
 from evernotebot.bot.errors import EvernoteBotException
-from evernotebot.bot.mixins.base import BaseMixin
-from evernotebot.storage import Storage
+from evernotebot.bot.mixins.base import BaseMixin, stage_duration
+from evernotebot.storage import AsyncStorage
 
 
 def dict_merge(d1: dict, d2: dict):
@@ -17,18 +18,27 @@ def dict_merge(d1: dict, d2: dict):
 class UserMixin(BaseMixin):
     def __init__(self, config: dict):
         super(UserMixin, self).__init__(config)
-        self.user = {}
-        self._users = Storage('users', config['storage'])
+        self._users = AsyncStorage('users', config['storage'], indexes=('evernote.oauth.callback_key',))
+
+    @property
+    def user(self) -> dict:
+        return current_context().user
+
+    @user.setter
+    def user(self, value: dict):
+        current_context().user = value
 
     async def on_bot_stop(self):
-        self._users.close()
+        await self._users.close()
 
     async def on_bot_update(self, update: dict):
         message = update.get('message') or update.get('channel_post')
         if not message:
             return
+        current_context().chat = message['chat']
         from_user = message.get('from') or message.get('sender_chat')
-        user = self._users.get(from_user['id'])
+        with stage_duration.time(stage='load_user'):
+            user = await self._users.get(from_user['id'])
         if not user:
             user = {
                 'id': from_user['id'],
@@ -50,7 +60,7 @@ class UserMixin(BaseMixin):
         text = f'Unregistered user {name}. You\'ve to send /start command to register'
         raise EvernoteBotException(text)
 
-    def save_user(self):
+    async def save_user(self):
         if not self.user.get('created'):
             current_time = time()
             user_data = copy(self.user)
@@ -62,17 +72,16 @@ class UserMixin(BaseMixin):
                     'access': 'readonly',
                 },
             })
-            self._users.create(user_data)
+            await self._users.create(user_data)
         else:
-            self._users.save(self.user)
+            await self._users.save(self.user)
 
     # def on_bot_update_finished(self):
         # self._users.close()
 
-    def find_user(self, query: dict) -> dict:
-        users = list(self._users.get_all(query))
+    async def find_user(self, query: dict) -> dict:
+        users = await self._users.get_all(query)
         if not users:
             raise Exception(f'Cant find user with query `{query}`')
-        user = users.pop()
-        self.user = self._users.get(user['id'])
+        self.user = users.pop()
         return self.user
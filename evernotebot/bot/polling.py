@@ -0,0 +1,150 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import perf_counter, time
+from typing import Awaitable, Callable, List, Optional
+
+from evernotebot.bot.api import BotApi
+from evernotebot.bot.queue import get_update_key
+
+
+logger = logging.getLogger('evernotebot')
+
+
+def get_update_date(update: dict) -> Optional[int]:
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if message := update.get(name):
+            return message.get('edit_date') or message.get('date')
+
+
+class UpdatePoller:
+    '''
+    Receives updates by `getUpdates` long polling instead of a webhook.
+    A batch of updates is processed by `handler`, at most `concurrency` chats
+    at once, updates of one chat one by one in order. The offset is moved
+    past a batch only when the whole batch is processed, so updates of an
+    interrupted batch are received again.
+    '''
+
+    def __init__(self, api: BotApi, handler: Callable[[dict], Awaitable], limit: int = 100,
+                 timeout: int = 30, concurrency: int = 64, retry_delay: float = 1.0,
+                 allowed_updates: Optional[List[str]] = None):
+        self.api = api
+        self.handler = handler
+        self.limit = min(max(limit, 1), 100)  # Bot API limits
+        self.timeout = timeout
+        self.concurrency = max(concurrency, 1)
+        self.retry_delay = retry_delay
+        self.allowed_updates = allowed_updates
+        self.offset: Optional[int] = None
+        self.batches = 0
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.errors = 0
+        self.last_batch_size = 0
+        self.last_batch_duration = 0.0
+        self.processing_time = 0.0
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._fetching = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        await self.api.deleteWebhook()  # getUpdates doesn't work while a webhook is set
+        self._stopping = False
+        self._task = asyncio.create_task(self._poll_forever())
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        if not self.running:
+            return
+        self._stopping = True
+        if self._fetching:
+            self._task.cancel()
+        done, _ = await asyncio.wait({self._task}, timeout=timeout)
+        if not done:
+            logger.warning(f'Updates batch is not processed in {timeout} seconds, it will be received again')
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self.offset is not None:
+            await self.commit()
+
+    async def commit(self) -> None:
+        '''
+        Confirms processed updates, Telegram drops them on a next `getUpdates`
+        '''
+        try:
+            await self.api.getUpdates(offset=self.offset, limit=1, timeout=0)
+        except Exception:
+            logger.warning(f'Failed to confirm updates before {self.offset}', exc_info=True)
+
+    async def _poll_forever(self) -> None:
+        while not self._stopping:
+            self._fetching = True
+            try:
+                updates = await self.api.getUpdates(offset=self.offset, limit=self.limit, timeout=self.timeout,
+                                                    allowed_updates=self.allowed_updates)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                logger.error('Failed to get updates', exc_info=True)
+                await asyncio.sleep(self.retry_delay)
+                continue
+            finally:
+                self._fetching = False
+            if updates:
+                await self.process_batch(updates)
+
+    async def process_batch(self, updates: List[dict]) -> None:
+        started = perf_counter()
+        self.batches += 1
+        self.received += len(updates)
+        self.last_batch_size = len(updates)
+        chats = OrderedDict()
+        for update in updates:
+            chats.setdefault(get_update_key(update), []).append(update)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def process_chat(chat_updates: List[dict]):
+            async with semaphore:
+                for update in chat_updates:
+                    await self._process(update)
+
+        await asyncio.gather(*(process_chat(chat_updates) for chat_updates in chats.values()))
+        self.offset = max(update['update_id'] for update in updates) + 1
+        self.last_batch_duration = perf_counter() - started
+        self.processing_time += self.last_batch_duration
+        dates = [date for date in map(get_update_date, updates) if date]
+        if dates:
+            self.lag = max(time() - min(dates), 0.0)
+
+    async def _process(self, update: dict) -> None:
+        try:
+            await self.handler(update)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logger.error(f'Update processing failed: {update}', exc_info=True)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'offset': self.offset,
+            'batches': self.batches,
+            'received': self.received,
+            'processed': self.processed,
+            'failed': self.failed,
+            'errors': self.errors,
+            'last_batch_size': self.last_batch_size,
+            'last_batch_duration': self.last_batch_duration,
+            'throughput': self.processing_time and (self.processed + self.failed) / self.processing_time,
+            'lag': self.lag,
+        }
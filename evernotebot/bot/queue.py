@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+
+logger = logging.getLogger('evernotebot')
+
+
+class UpdateQueueFull(Exception):
+    pass
+
+
+def get_chat_id(update: dict) -> Optional[int]:
+    for name in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if message := update.get(name):
+            return message.get('chat', {}).get('id')
+
+
+def get_update_key(update: dict) -> Hashable:
+    chat_id = get_chat_id(update)
+    return chat_id if chat_id is not None else update.get('update_id', 0)
+
+
+class UpdateQueue:
+    '''
+    Updates are partitioned between workers by chat id, so updates of one chat
+    are always processed by the same worker in the order they were received.
+    Items other than updates need a `key` function returning their chat id.
+    '''
+
+    def __init__(self, handler: Callable[[Any], Awaitable], workers: int = 1, max_size: int = 1000,
+                 key: Callable[[Any], Hashable] = get_update_key):
+        self.handler = handler
+        self.key = key
+        self.workers_count = max(workers, 1)
+        self.max_size = max_size
+        self.size = 0
+        self.max_size_reached = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queues = [asyncio.Queue() for _ in range(self.workers_count)]
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Update queue is not drained in {timeout} seconds, {self.size} updates are dropped')
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+        self.size = 0
+
+    def put(self, update: Any) -> None:
+        if self.size >= self.max_size:
+            self.rejected += 1
+            raise UpdateQueueFull(f'Update queue is full ({self.size} updates)')
+        self.start()
+        self._queues[hash(self.key(update)) % self.workers_count].put_nowait(update)
+        self.size += 1
+        self.max_size_reached = max(self.max_size_reached, self.size)
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        while True:
+            update = await queue.get()
+            try:
+                await self.handler(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.error(f'Update processing failed: {update}', exc_info=True)
+            finally:
+                self.size -= 1
+                queue.task_done()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'depth': self.size,
+            'max_depth': self.max_size_reached,
+            'max_size': self.max_size,
+            'workers': self.workers_count,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from copy import deepcopy
+from itertools import count
+from operator import itemgetter
+from os.path import join
+from typing import Dict, Hashable, Iterable, List, Optional
+
+from evernotebot.bot.queue import UpdateQueue, UpdateQueueFull, get_update_key
+from evernotebot.util.logs import init_logging
+
+
+logger = logging.getLogger('evernotebot')
+
+
+class WorkerError(Exception):
+    pass
+
+
+def rendezvous_score(key: Hashable, index: int) -> int:
+    digest = hashlib.blake2b(f'{key}:{index}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def pick_worker(key: Hashable, indexes: Iterable[int]) -> int:
+    return max(indexes, key=lambda index: rendezvous_score(key, index))
+
+
+class WorkerProcess:
+    def __init__(self, index: int, process: multiprocessing.Process, inbox: multiprocessing.Queue, restarts: int):
+        self.index = index
+        self.process = process
+        self.inbox = inbox
+        self.restarts = restarts
+        self.ready = False
+        self.processed = 0
+        self.metrics = []  # the last metrics sent by the worker
+        self.jobs: Dict[int, dict] = {}  # sent to the worker and not finished yet
+
+
+class WorkerPool:
+    '''
+    Runs `processes` worker processes, each with its own `EvernoteBot`, and
+    routes jobs (updates, OAuth callbacks) to them by chat id. A chat belongs
+    to a worker by rendezvous hashing over the ready workers, so when a worker
+    dies only its chats move to other workers and its unfinished jobs are sent
+    again. While a chat has unfinished jobs, its new jobs go to the same
+    worker, so they are processed in order when workers come and go.
+    '''
+
+    def __init__(self, config: dict, processes: int = 2, max_pending: int = 1000, restart_delay: float = 1.0,
+                 start_timeout: float = 60.0, metrics_interval: float = 5.0):
+        self.config = config
+        self.processes = max(processes, 1)
+        self.max_pending = max_pending
+        self.restart_delay = restart_delay
+        self.start_timeout = start_timeout
+        self.metrics_interval = metrics_interval
+        self.workers: List[Optional[WorkerProcess]] = []
+        self.redelivered = 0
+        self.rejected = 0
+        self.failed = 0
+        self.lost = 0
+        self._context = multiprocessing.get_context('spawn')  # a fork would copy the running event loop
+        self._outbox: Optional[multiprocessing.Queue] = None
+        self._reader: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._chats: Dict[Hashable, list] = {}  # key -> [worker index, unfinished jobs]
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._job_ids = count(1)
+        self._all_ready: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return bool(self.workers)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._all_ready = asyncio.Event()
+        self._outbox = self._context.Queue()
+        self._reader = threading.Thread(target=self._read_outbox, name='evernotebot-workers', daemon=True)
+        self._reader.start()
+        self.workers = [None] * self.processes
+        for index in range(self.processes):
+            self._spawn(index)
+        try:
+            await asyncio.wait_for(self._all_ready.wait(), self.start_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Worker processes are not ready in {self.start_timeout} seconds')
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        if not self.running:
+            return
+        self._stopping = True
+        workers = [worker for worker in self.workers if worker]
+        for worker in workers:
+            worker.inbox.put(None)  # workers finish their jobs and exit
+
+        def join(worker: WorkerProcess):
+            worker.process.join(timeout)
+            if worker.process.is_alive():
+                logger.warning(f'Worker {worker.index} is not stopped in {timeout} seconds, terminating')
+                worker.process.terminate()
+                worker.process.join()
+
+        await asyncio.gather(*(self._loop.run_in_executor(None, join, worker) for worker in workers))
+        for worker in workers:
+            self._loop.remove_reader(worker.process.sentinel)
+        self._outbox.put(None)
+        await self._loop.run_in_executor(None, self._reader.join)
+        for future in self._futures.values():
+            if not future.done():
+                future.set_exception(WorkerError('Worker processes are stopped'))
+        self._futures = {}
+        self._chats = {}
+        self.workers = []
+
+    def worker_config(self, index: int) -> dict:
+        config = deepcopy(self.config)
+        config['processes'] = 1
+        config['telegram']['updates_mode'] = 'webhook'  # updates are received by this process
+        config['tmp_root'] = join(config['tmp_root'], f'worker-{index}')
+        queue_config = config.setdefault('queue', {})
+        queue_config['max_size'] = self.max_pending * self.processes  # jobs of a dead worker are added over the limit
+        return config
+
+    def _spawn(self, index: int, restarts: int = 0) -> None:
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=run_worker,
+            args=(index, self.worker_config(index), inbox, self._outbox, self.metrics_interval),
+            name=f'evernotebot-worker-{index}',
+            daemon=True,
+        )
+        process.start()
+        self.workers[index] = WorkerProcess(index, process, inbox, restarts)
+        self._loop.add_reader(process.sentinel, self._on_exit, index)
+
+    def _read_outbox(self) -> None:
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                break
+            self._loop.call_soon_threadsafe(self._on_message, message)
+
+    def _on_message(self, message: tuple) -> None:
+        kind, index, pid, *args = message
+        worker = self.workers[index] if self.workers else None
+        if worker is None or worker.process.pid != pid:
+            worker = None  # a message of a dead worker
+        if kind == 'ready' and worker is not None:
+            worker.ready = True
+            logger.info(f'Worker {index} is ready (pid {pid})')
+            if all(worker and worker.ready for worker in self.workers):
+                self._all_ready.set()
+        elif kind == 'done':
+            job_id, error = args
+            self._finish(worker, job_id, error)
+        elif kind == 'metrics' and worker is not None:
+            worker.metrics = args[0]
+
+    def _finish(self, worker: Optional[WorkerProcess], job_id: int, error: Optional[str]) -> None:
+        job = worker.jobs.pop(job_id, None) if worker else None
+        if job is None:
+            return  # the worker died and the job is sent to another one
+        worker.processed += 1
+        chat = self._chats[job['key']]
+        chat[1] -= 1
+        if not chat[1]:
+            del self._chats[job['key']]
+        if error:
+            self.failed += 1
+        future = self._futures.pop(job_id, None)
+        if future is not None and not future.done():
+            if error:
+                future.set_exception(WorkerError(error))
+            else:
+                future.set_result(None)
+
+    def _on_exit(self, index: int) -> None:
+        worker = self.workers[index]
+        self._loop.remove_reader(worker.process.sentinel)
+        if self._stopping:
+            return
+        worker.process.join()
+        self.workers[index] = None
+        self._all_ready.clear()
+        jobs = sorted(worker.jobs.values(), key=itemgetter('id'))
+        logger.error(f'Worker {index} (pid {worker.process.pid}) exited with code {worker.process.exitcode}, '
+                     f'{len(jobs)} unfinished jobs are sent to other workers')
+        for job in jobs:
+            self._chats.pop(job['key'], None)
+        for job in jobs:
+            new_index = self._route(job['key'])
+            if new_index is None:
+                self.lost += 1
+                future = self._futures.pop(job['id'], None)
+                if future is not None and not future.done():
+                    future.set_exception(WorkerError('No workers are ready'))
+                continue
+            self._send(self.workers[new_index], job)
+            self.redelivered += 1
+        self._loop.call_later(self.restart_delay, self._restart, index, worker.restarts + 1)
+
+    def _restart(self, index: int, restarts: int) -> None:
+        if not self._stopping and self.running and self.workers[index] is None:
+            self._spawn(index, restarts)
+
+    def _route(self, key: Hashable) -> Optional[int]:
+        chat = self._chats.get(key)
+        if chat is not None:
+            return chat[0]
+        indexes = [worker.index for worker in self.workers if worker and worker.ready]
+        if not indexes:
+            return None
+        return pick_worker(key, indexes)
+
+    def _send(self, worker: WorkerProcess, job: dict) -> None:
+        worker.jobs[job['id']] = job
+        chat = self._chats.setdefault(job['key'], [worker.index, 0])
+        chat[1] += 1
+        worker.inbox.put(job)
+
+    def submit(self, key: Hashable, method: str, *args, wait: bool = False) -> Optional[asyncio.Future]:
+        '''
+        Sends a call of `EvernoteBot.<method>(*args)` to the worker of chat `key`.
+        Returns a future of the call result if `wait` is set.
+        '''
+        index = None if self._stopping or not self.running else self._route(key)
+        if index is None:
+            self.rejected += 1
+            raise UpdateQueueFull('No worker processes are ready')
+        worker = self.workers[index]
+        if len(worker.jobs) >= self.max_pending:
+            self.rejected += 1
+            raise UpdateQueueFull(f'Worker {index} is full ({len(worker.jobs)} jobs)')
+        job = {'id': next(self._job_ids), 'key': key, 'method': method, 'args': args}
+        self._send(worker, job)
+        if wait:
+            future = self._loop.create_future()
+            self._futures[job['id']] = future
+            return future
+
+    async def call(self, key: Hashable, method: str, *args, retry_delay: float = 0.1) -> None:
+        while True:
+            try:
+                future = self.submit(key, method, *args, wait=True)
+            except UpdateQueueFull:
+                if self._stopping or not self.running:
+                    raise
+                await asyncio.sleep(retry_delay)  # waiting for a worker to be ready or free
+                continue
+            return await future
+
+    def put_update(self, update: dict) -> None:
+        self.submit(get_update_key(update), 'process_update', update)
+
+    async def process_update(self, update: dict) -> None:
+        await self.call(get_update_key(update), 'process_update', update)
+
+    @property
+    def metrics(self) -> Dict[int, list]:
+        return {worker.index: worker.metrics for worker in self.workers if worker}
+
+    @property
+    def stats(self) -> dict:
+        workers = []
+        for index, worker in enumerate(self.workers):
+            if worker is None:
+                workers.append({'index': index, 'alive': False})
+                continue
+            workers.append({
+                'index': index,
+                'alive': True,
+                'pid': worker.process.pid,
+                'ready': worker.ready,
+                'pending': len(worker.jobs),
+                'processed': worker.processed,
+                'restarts': worker.restarts,
+            })
+        return {
+            'workers': workers,
+            'chats': len(self._chats),
+            'redelivered': self.redelivered,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'lost': self.lost,
+        }
+
+
+class Worker:
+    '''
+    A worker process: jobs from `inbox` are processed by its own bot,
+    job results and metrics of the bot are put to `outbox`.
+    '''
+
+    def __init__(self, index: int, config: dict, inbox: multiprocessing.Queue, outbox: multiprocessing.Queue,
+                 metrics_interval: float = 5.0):
+        self.index = index
+        self.config = config
+        self.inbox = inbox
+        self.outbox = outbox
+        self.metrics_interval = metrics_interval
+        self.bot = None
+
+    async def run(self) -> None:
+        from evernotebot.bot import EvernoteBot  # the bot package imports this module
+
+        loop = asyncio.get_running_loop()
+        self.bot = EvernoteBot(self.config)
+        queue = UpdateQueue(self.process, key=itemgetter('key'), **self.config.get('queue', {}))
+        await self.bot.start()
+        self.outbox.put(('ready', self.index, os.getpid()))
+        metrics_sender = asyncio.create_task(self.send_metrics())
+        while True:
+            job = await loop.run_in_executor(None, self.inbox.get)
+            if job is None:
+                break
+            try:
+                queue.put(job)
+            except UpdateQueueFull as e:
+                self.outbox.put(('done', self.index, os.getpid(), job['id'], str(e)))
+        await queue.stop()
+        metrics_sender.cancel()
+        await self.bot.stop()
+
+    async def send_metrics(self) -> None:
+        while True:
+            try:
+                self.outbox.put(('metrics', self.index, os.getpid(), self.bot.metrics()))
+            except Exception:
+                logger.error('Failed to send metrics', exc_info=True)
+            await asyncio.sleep(self.metrics_interval)
+
+    async def process(self, job: dict) -> None:
+        error = None
+        try:
+            await getattr(self.bot, job['method'])(*job['args'])
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self.outbox.put(('done', self.index, os.getpid(), job['id'], error))
+
+
+def run_worker(index: int, config: dict, inbox: multiprocessing.Queue, outbox: multiprocessing.Queue,
+               metrics_interval: float = 5.0) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the front process stops workers
+    os.makedirs(config['tmp_root'], exist_ok=True)
+    init_logging(config['logs_root'], debug=config['debug'])
+    asyncio.run(Worker(index, config, inbox, outbox, metrics_interval).run())
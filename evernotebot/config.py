@@ -33,15 +33,53 @@ def load_config():
         'port': port,
         'oauth_callback_url': os.getenv('OAUTH_CALLBACK_URL') or default_oauth_url,
         'webhook_url': os.getenv('WEBHOOK_URL') or default_webhook_url,
+        'max_request_body_size': int(os.getenv('EVERNOTEBOT_MAX_REQUEST_BODY_SIZE') or 1024 * 1024),
+        # Path of Prometheus metrics, disabled if empty. It isn't protected, so use a hard to guess path or a proxy
+        'metrics_path': os.getenv('EVERNOTEBOT_METRICS_PATH') or None,
         # 'logs_root': root_dir('logs/'),
         'logs_root': '',
         'tmp_root': os.getenv('TMP_ROOT') or root_dir('tmp/'),
+        'tmp': {
+            'max_age': 3600,
+            'max_size': int(os.getenv('TMP_MAX_SIZE') or 1024 ** 3),
+            'sweep_interval': 300,
+        },
+        'files_cache': {
+            'max_size': int(os.getenv('FILES_CACHE_MAX_SIZE') or 256 * 1024 * 1024),
+        },
         'telegram': {
             'bot_name': bot_name,
             'token': bot_api_token,
-            'api_url': os.getenv('BOT_API_URL') or default_bot_api_url
+            'api_url': os.getenv('BOT_API_URL') or default_bot_api_url,
+            'updates_mode': os.getenv('TELEGRAM_UPDATES_MODE') or 'webhook',  # or `polling`
+            'polling': {
+                'limit': 100,
+                'timeout': int(os.getenv('TELEGRAM_POLLING_TIMEOUT') or 30),
+                'concurrency': int(os.getenv('TELEGRAM_POLLING_CONCURRENCY') or 64),
+            },
+            'download_chunk_size': int(os.getenv('BOT_API_DOWNLOAD_CHUNK_SIZE') or 256 * 1024),
+            'pool': {
+                'limit': int(os.getenv('BOT_API_POOL_SIZE') or 100),
+                'limit_per_host': int(os.getenv('BOT_API_POOL_SIZE_PER_HOST') or 20),
+                'keepalive_timeout': 30,
+                'ttl_dns_cache': 300,
+            },
         },
         'evernote': {
+            'executor': {
+                'max_workers': int(os.getenv('EVERNOTE_MAX_WORKERS') or 16),
+            },
+            'clients_cache': {
+                'max_size': 1000,
+                'ttl': 3600,
+            },
+            'user_info_ttl': 3600,
+            'quota_ttl': 300,
+            'notebooks_ttl': 600,
+            'one_note_batch': {
+                'delay': float(os.getenv('EVERNOTE_ONE_NOTE_BATCH_DELAY') or 0.5),
+                'max_fragments': 20,
+            },
             'access': {
                 'readonly': {
                     'key': os.getenv('EVERNOTE_READONLY_KEY'),
@@ -53,10 +91,20 @@ def load_config():
                 },
             },
         },
+        'processes': int(os.getenv('EVERNOTEBOT_PROCESSES') or 1),  # worker processes, chats are split between them
+        'queue': {
+            'workers': int(os.getenv('EVERNOTEBOT_QUEUE_WORKERS') or 64),
+            'max_size': int(os.getenv('EVERNOTEBOT_QUEUE_MAX_SIZE') or 1000),
+        },
         'storage': {
-            'provider': 'evernotebot.storage.providers.postgres.PostgreSQL',
+            'provider': os.getenv('EVERNOTEBOT_STORAGE_PROVIDER') or 'evernotebot.storage.providers.postgres.AsyncPostgreSQL',
             'db_name': bot_name,
-            'dirpath': '',
+            'dirpath': os.getenv('EVERNOTEBOT_STORAGE_DIR') or '',
+            'pool': {
+                'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE') or 1),
+                'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE') or 10),
+                'check_interval': 30,
+            },
         },
     }
     make_dirs(config)
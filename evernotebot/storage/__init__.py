@@ -1,20 +1,32 @@
 import copy
 import importlib
-from typing import Dict, Generator, Optional
+from typing import Dict, Generator, List, Optional, Sequence
 
 import evernotebot.storage.providers as providers
+from evernotebot.util.metrics import registry
+
+
+query_duration = registry.histogram(
+    'evernotebot_storage_query_duration_seconds', 'Time of storage queries',
+    labels=('provider', 'collection', 'operation'))
+
+
+def make_provider(name: str, config: dict, indexes: Sequence[str] = ()):
+    provider_classpath = config['provider']
+    module_name, class_name = provider_classpath.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    provider_class = getattr(module, class_name)
+    config_copy = copy.deepcopy(config)
+    del config_copy['provider']
+    config_copy['collection'] = name
+    if indexes:
+        config_copy['indexes'] = indexes
+    return provider_class(**config_copy)
 
 
 class Storage:
-    def __init__(self, name: str, config: dict):
-        provider_classpath = config['provider']
-        module_name, class_name = provider_classpath.rsplit('.', 1)
-        module = importlib.import_module(module_name)
-        provider_class = getattr(module, class_name)
-        config_copy = copy.deepcopy(config)
-        del config_copy['provider']
-        config_copy['collection'] = name
-        self.provider = provider_class(**config_copy)
+    def __init__(self, name: str, config: dict, indexes: Sequence[str] = ()):
+        self.provider = make_provider(name, config, indexes)
 
     def create(self, data: dict):
         if 'id' in data:
@@ -35,3 +47,40 @@ class Storage:
 
     def close(self):
         return self.provider.close()
+
+
+class AsyncStorage:
+    def __init__(self, name: str, config: dict, indexes: Sequence[str] = ()):
+        self.provider = make_provider(name, config, indexes)
+        if not isinstance(self.provider, providers.AsyncBaseProvider):
+            raise Exception(f'Provider `{config["provider"]}` is not async')
+        self.name = name
+        self._provider_name = type(self.provider).__name__
+
+    def _timer(self, operation: str):
+        return query_duration.time(provider=self._provider_name, collection=self.name, operation=operation)
+
+    async def create(self, data: dict) -> int:
+        with self._timer('create'):
+            if 'id' in data:
+                return await self.provider.create(data)
+            return await self.provider.create(data, auto_generate_id=True)
+
+    async def get(self, object_id: int, fail_if_not_exists: bool = False) -> Dict:
+        with self._timer('get'):
+            return await self.provider.get(object_id, fail_if_not_exists)
+
+    async def get_all(self, query: Optional[Dict] = None) -> List[Dict]:
+        with self._timer('get_all'):
+            return await self.provider.get_all(query)
+
+    async def save(self, data: dict) -> int:
+        with self._timer('save'):
+            return await self.provider.save(data)
+
+    async def delete(self, object_id: int, check_deleted_count: bool = True):
+        with self._timer('delete'):
+            return await self.provider.delete(object_id, check_deleted_count)
+
+    async def close(self):
+        return await self.provider.close()
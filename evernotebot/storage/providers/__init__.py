@@ -1,6 +1,27 @@
+import re
 import typing
 from abc import ABCMeta, abstractmethod
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional
+
+
+def flatten_query(query: dict, prefix: str = '') -> Dict[str, Any]:
+    """Turns `{'a': {'b': 1}, 'c.d': 2}` into `{'a.b': 1, 'c.d': 2}`"""
+    flat = {}
+    for key, value in query.items():
+        path = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten_query(value, f'{path}.'))
+        else:
+            flat[path] = value
+    return flat
+
+
+def split_path(path: str) -> List[str]:
+    names = path.split('.')
+    for name in names:
+        if not re.fullmatch(r'\w+', name):
+            raise Exception(f'Invalid field path `{path}`')
+    return names
 
 
 class BaseProvider(metaclass=ABCMeta):
@@ -27,3 +48,29 @@ class BaseProvider(metaclass=ABCMeta):
     @abstractmethod
     def close(self) -> None:
         pass
+
+
+class AsyncBaseProvider(metaclass=ABCMeta):
+    @abstractmethod
+    async def create(self, data: dict, auto_generate_id=False) -> int:
+        pass
+
+    @abstractmethod
+    async def get(self, object_id: int, fail_if_not_exists: bool = False) -> Dict:
+        pass
+
+    @abstractmethod
+    async def get_all(self, query: Optional[Dict] = None) -> List[Dict]:
+        pass
+
+    @abstractmethod
+    async def save(self, data: dict) -> int:
+        pass
+
+    @abstractmethod
+    async def delete(self, object_id: int, check_deleted_count: bool = True) -> None:
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
@@ -1,19 +1,61 @@
+import asyncio
 import json
 import os
 import sqlite3
 import typing
 from os.path import exists
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-from evernotebot.storage.providers import BaseProvider
+import aiosqlite
+
+from evernotebot.storage.providers import AsyncBaseProvider, BaseProvider, flatten_query, split_path
+
+
+def json_field(path: str) -> str:
+    names = split_path(path)
+    return f"json_extract(data, '$.{'.'.join(names)}')"
+
+
+def sql_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, tuple)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def make_select(table: str, query: dict) -> Tuple[str, tuple]:
+    conditions = []
+    args = []
+    for path, value in flatten_query(query).items():
+        field = 'id' if path == 'id' else json_field(path)
+        if value is None:
+            conditions.append(f'{field} IS NULL')
+        else:
+            conditions.append(f'{field}=?')
+            args.append(sql_value(value))
+    sql = f'SELECT id, data FROM {table}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql, tuple(args)
+
+
+def make_indexes(table: str, indexes: Sequence[str]) -> List[str]:
+    statements = []
+    for path in indexes:
+        name = '_'.join([table] + split_path(path))
+        statements.append(f'CREATE INDEX IF NOT EXISTS {name}_idx ON {table}({json_field(path)})')
+    return statements
 
 
 class Sqlite(BaseProvider):
-    def __init__(self, dirpath: str, *, collection: str = None, db_name: str = None) -> None:
+    def __init__(self, dirpath: str, *, collection: str = None, db_name: str = None,
+                 pool: Optional[dict] = None, indexes: Sequence[str] = ()) -> None:
         if not exists(dirpath):
             os.makedirs(dirpath)
         self.db_filepath = f'{dirpath}/{db_name}.sqlite'
         self._table_name = collection
+        self._indexes = make_indexes(collection, indexes)
         self._connection = None
 
     def _connect(self):
@@ -22,6 +64,8 @@ class Sqlite(BaseProvider):
             f'CREATE TABLE IF NOT EXISTS {self._table_name}'
             '(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT)'
         )
+        for sql in self._indexes:
+            self.__execute_sql(sql)
 
     @property
     def connection(self):
@@ -30,9 +74,8 @@ class Sqlite(BaseProvider):
         return self._connection
 
     def __execute_sql(self, sql: str, *args) -> sqlite3.Cursor:
-        sql = sql.strip().upper()
         cursor = self.connection.execute(sql, args)
-        if not sql.startswith('SELECT'):
+        if not sql.lstrip().upper().startswith('SELECT'):
             self.connection.commit()
         return cursor
 
@@ -60,40 +103,13 @@ class Sqlite(BaseProvider):
         return result and result[0]
 
     def get_all(self, query: Optional[Dict] = None) -> typing.Generator:
-        if query is None:
-            query = {}
-        table = self._table_name
-        args = tuple()
-        if 'id' in query:
-            sql = f'SELECT id, data FROM {table} WHERE id=?'
-            args = (query['id'],)
-        else:
-            sql = f'SELECT id, data FROM {table}'
+        sql, args = make_select(self._table_name, query or {})
         cursor = self.__execute_sql(sql, *args)
         objects = cursor.fetchall()
-        if not objects:
-            return tuple()
         for object_id, json_data in objects:
             data = json.loads(json_data)
             data['id'] = object_id
-            if self._check_query(data, query):
-                yield data
-
-    def _check_query(self, document: dict, query: dict) -> bool:
-        matched = True
-        for k, query_value in query.items():
-            key_value = document
-            for name in k.split('.'):
-                key_value = key_value.get(name) if isinstance(key_value, dict) else None
-                if key_value is None:
-                    break
-            if isinstance(query_value, dict):
-                matched = self._check_query(key_value, query_value)
-            else:
-                matched = key_value == query_value
-            if not matched:
-                return False
-        return matched
+            yield data
 
     def save(self, data: dict) -> int:
         object_id = data['id']
@@ -121,3 +137,145 @@ class Sqlite(BaseProvider):
             pass
         finally:
             self.connection.close()
+
+
+# (event loop, db file) -> [connecting task, number of providers]
+_shared_connections: Dict[tuple, list] = {}
+
+
+async def _connect(db_filepath: str) -> aiosqlite.Connection:
+    # Autocommit: a failed statement never leaves a transaction open
+    return await aiosqlite.connect(db_filepath, isolation_level=None)
+
+
+async def acquire_connection(db_filepath: str) -> aiosqlite.Connection:
+    '''
+    Collections of one database file share a connection, so their writes
+    don't wait for each other's locks on the file.
+    '''
+    key = (asyncio.get_running_loop(), db_filepath)
+    shared = _shared_connections.get(key)
+    if shared is None:
+        shared = _shared_connections[key] = [asyncio.create_task(_connect(db_filepath)), 0]
+    shared[1] += 1
+    try:
+        return await shared[0]
+    except BaseException:
+        await release_connection(db_filepath)
+        raise
+
+
+async def release_connection(db_filepath: str) -> None:
+    key = (asyncio.get_running_loop(), db_filepath)
+    shared = _shared_connections.get(key)
+    if shared is None:
+        return
+    shared[1] -= 1
+    if shared[1] > 0:
+        return
+    del _shared_connections[key]
+    task = shared[0]
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and task.exception() is None:
+        await task.result().close()
+
+
+class AsyncSqlite(AsyncBaseProvider):
+    def __init__(self, dirpath: str, *, collection: str = None, db_name: str = None,
+                 pool: Optional[dict] = None, indexes: Sequence[str] = ()) -> None:
+        if not exists(dirpath):
+            os.makedirs(dirpath)
+        self.db_filepath = f'{dirpath}/{db_name}.sqlite'
+        self._table_name = collection
+        self._indexes = make_indexes(collection, indexes)
+        self._connection: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._closed = False
+
+    async def connection(self) -> aiosqlite.Connection:
+        if self._closed:
+            raise Exception('Storage is closed')
+        if self._connection is None:
+            async with self._connect_lock:
+                if self._connection is None:
+                    connection = await acquire_connection(self.db_filepath)
+                    try:
+                        await connection.execute(
+                            f'CREATE TABLE IF NOT EXISTS {self._table_name}'
+                            '(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT)'
+                        )
+                        for sql in self._indexes:
+                            await connection.execute(sql)
+                    except BaseException:
+                        await release_connection(self.db_filepath)
+                        raise
+                    self._connection = connection
+        return self._connection
+
+    async def __execute_sql(self, sql: str, *args) -> aiosqlite.Cursor:
+        connection = await self.connection()
+        try:
+            return await connection.execute(sql, args)
+        except Exception:
+            if connection.in_transaction:
+                await connection.rollback()
+            raise
+
+    async def create(self, data: dict, auto_generate_id: bool = False) -> int:
+        table = self._table_name
+        if auto_generate_id:
+            if 'id' in data:
+                del data['id']
+            sql = f'INSERT INTO {table}(data) VALUES(?)'
+            cursor = await self.__execute_sql(sql, json.dumps(data))
+        else:
+            object_id = data['id']
+            if object_id <= 0:
+                raise Exception(f'Invalid id `{object_id}`. Id must be >= 0')
+            cursor = await self.__execute_sql(f'INSERT INTO {table}(id, data) VALUES(?, ?)',
+                                              object_id, json.dumps(data))
+        return cursor.lastrowid
+
+    async def get(self, object_id: int, fail_if_not_exists: bool = False) -> Dict:
+        query = object_id if isinstance(object_id, dict) else {'id': object_id}
+        result = await self.get_all(query)
+        if fail_if_not_exists and not result:
+            raise Exception(f'Object not found. Query: {query}')
+        return result and result[0]
+
+    async def get_all(self, query: Optional[Dict] = None) -> List[Dict]:
+        sql, args = make_select(self._table_name, query or {})
+        cursor = await self.__execute_sql(sql, *args)
+        objects = await cursor.fetchall()
+        result = []
+        for object_id, json_data in objects:
+            data = json.loads(json_data)
+            data['id'] = object_id
+            result.append(data)
+        return result
+
+    async def save(self, data: dict) -> int:
+        object_id = data['id']
+        if not object_id:
+            return await self.create(data, auto_generate_id=True)
+        table = self._table_name
+        sql = f'UPDATE {table} SET data=? WHERE id=?'
+        cursor = await self.__execute_sql(sql, json.dumps(data), object_id)
+        if cursor.rowcount == 0:
+            raise Exception(f'Object `{object_id}` not found')
+        return object_id
+
+    async def delete(self, object_id: int, check_deleted_count: bool = True) -> None:
+        table = self._table_name
+        sql = f'DELETE FROM {table} WHERE id=?'
+        cursor = await self.__execute_sql(sql, object_id)
+        if check_deleted_count and cursor.rowcount != 1:
+            raise Exception(f'Object `{object_id}` not found')
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._connection is None:
+            return
+        self._connection = None
+        await release_connection(self.db_filepath)
@@ -2,11 +2,24 @@ import json
 import logging
 import re
 import traceback
-from functools import partial
-from time import time
-from typing import Coroutine
+from time import perf_counter, time
+from typing import Callable, Coroutine, List, Optional, Tuple
 from urllib.parse import parse_qsl
 
+from evernotebot.util.metrics import Family, registry, render
+
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time of HTTP requests', labels=('handler', 'status'))
+
+
+class RequestBodyTooLarge(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
 
 class Jsonable:
     def __str__(self):
@@ -28,7 +41,7 @@ class Response(Jsonable):
     async def send(self, status: int = None, headers: list[tuple[str, bytes]] = None, body: bytes = None):
         status = status or self.status
         body = body or self.body or b''
-        headers = self.validate_headers(headers, body)
+        headers = self.validate_headers(headers or self.headers, body)
         await self._send({
             'type': 'http.response.start',
             'status': status,
@@ -40,15 +53,21 @@ class Response(Jsonable):
         })
 
     def validate_headers(self, headers: list[tuple[str, bytes]], body: bytes):
-        headers = headers or []
         content_length = None
         content_type = None
-        for name, value in headers:
-            name = name.lower().strip().encode()
+        normalized_headers = []
+        for name, value in headers or []:
+            if isinstance(name, str):
+                name = name.encode()
+            if not isinstance(value, bytes):
+                value = str(value).encode()
+            name = name.lower().strip()
             if name == b'content-type':
                 content_type = value
             elif name == b'content-length':
                 content_length = value
+            normalized_headers.append((name, value))
+        headers = normalized_headers
         if not content_length:
             headers.append((b'content-length', str(len(body)).encode()))
         if not content_type:
@@ -56,22 +75,24 @@ class Response(Jsonable):
         return headers
 
     def __to_dict__(self):
-        body = self.body and self.body.decode() or None
         return {
             'create_time': self.create_time,
-            'body': body,
+            'body_size': len(self.body or b''),
             'status': self.status,
             'error': self.error,
         }
 
 
 class Request(Jsonable):
-    def __init__(self, scope, receive, send):
+    def __init__(self, scope, receive, send, max_body_size: Optional[int] = None):
         self._scope = scope
         self._receive = receive
         self._send = send
+        self.max_body_size = max_body_size
         self.create_time = time()
+        self.start_time = perf_counter()
         self.body = None
+        self._json = None
         self.path = scope.get('path', '/')
         self.query_string = scope.get('query_string').decode()
         self.method = scope.get('method', 'GET')
@@ -87,55 +108,135 @@ class Request(Jsonable):
         response.body = body
         return response
 
+    def get_header(self, name: bytes) -> Optional[bytes]:
+        for header_name, value in self._scope.get('headers', ()):
+            if header_name.lower() == name:
+                return value
+
     async def read(self) -> bytes:
+        if self.body is not None:
+            return self.body
+        max_size = self.max_body_size
+        content_length = self.get_header(b'content-length')
+        if content_length is not None:
+            try:
+                content_length = int(content_length)
+            except ValueError:
+                content_length = -1
+            if content_length < 0:
+                raise BadRequest('Invalid content-length header')
+        if max_size is not None and content_length and content_length > max_size:
+            raise RequestBodyTooLarge(f'Request body exceeds {max_size} bytes')
         data = {'more_body': True}
-        buffer = b''
+        buffer = bytearray()
         while data.get('more_body'):
             data = await self._receive()
             if data.get('type') == 'http.request':
-                buffer += data.get('body', b'')
-        self.body = buffer
-        return buffer
+                buffer.extend(data.get('body', b''))
+                if max_size is not None and len(buffer) > max_size:
+                    raise RequestBodyTooLarge(f'Request body exceeds {max_size} bytes')
+            elif data.get('type') == 'http.disconnect':
+                break
+        self.body = bytes(buffer)
+        return self.body
 
     async def json(self) -> dict:
-        if self.body is None:
-            await self.read()
-        data = self.body or None
-        if not data:
-            return {}
-        return json.loads(data)
+        if self._json is None:
+            data = await self.read()
+            self._json = json.loads(data) if data else {}
+        return self._json
 
     def __to_dict__(self):
-        body = self.body and self.body.decode() or None
         return {
             'create_time': self.create_time,
-            'body': body,
+            'method': self.method,
+            'path': self.path,
+            'body_size': len(self.body or b''),
         }
 
 
-class AsgiApplication:
+class Router:
+    '''
+    Routes are compiled once: paths without regex syntax are looked up in a dict,
+    the rest of the routes of a method are matched with one combined regex.
+    '''
+    _special_chars = set('.^$*+?{}[]\\|()')
+
     def __init__(self, url_schema):
-        self.handlers = []
-        self.logger = logging.getLogger('wsgi')
+        self._exact = {}  # method -> {path: handler}
+        self._patterns = {}  # method -> [(pattern, handler)]
         for method, path, handler in url_schema:
-            self.handlers.append((method, re.compile(path), handler))
+            method = method.upper()
+            literal = path.removeprefix('^').removesuffix('$')
+            if path.startswith('^') and path.endswith('$') and not self._special_chars & set(literal):
+                self._exact.setdefault(method, {})[literal] = handler
+            else:
+                self._patterns.setdefault(method, []).append((path, handler))
+        self._regexes = {}  # method -> (combined regex, {group index: (handler, number of groups)})
+        for method, routes in self._patterns.items():
+            parts = []
+            handlers = {}
+            index = 1
+            for path, handler in routes:
+                groups_count = re.compile(path).groups
+                parts.append(f'({path})')
+                handlers[index] = (handler, groups_count)
+                index += groups_count + 1
+            self._regexes[method] = (re.compile('|'.join(parts)), handlers)
 
-    def get_handler(self, url_path, http_method):
-        for method, regex_object, handler in self.handlers:
-            if method.lower() == http_method.lower() and (matched := regex_object.match(url_path)):
-                groups = matched.groups()
-                return partial(handler, *groups)
+    def match(self, path: str, method: str) -> Optional[Tuple[Callable, tuple]]:
+        handler = self._exact.get(method, {}).get(path)
+        if handler is not None:
+            return handler, ()
+        regex, handlers = self._regexes.get(method, (None, None))
+        if regex is None or not (matched := regex.match(path)):
+            return None
+        index = matched.lastindex
+        handler, groups_count = handlers[index]
+        return handler, matched.groups()[index:index + groups_count]
+
+
+class AsgiApplication:
+    max_logged_body_size = 1024  # bodies are logged on DEBUG level only
+
+    def __init__(self, url_schema, max_body_size: Optional[int] = 1024 * 1024,
+                 metrics_path: Optional[str] = None):
+        self.max_body_size = max_body_size
+        if metrics_path:
+            url_schema = tuple(url_schema) + (('GET', f'^{metrics_path}$', self.metrics),)
+        self.router = Router(url_schema)
+        self.logger = logging.getLogger('wsgi')
+
+    def get_handler(self, url_path, http_method) -> Optional[Tuple[Callable, tuple]]:
+        return self.router.match(url_path, http_method.upper())
+
+    async def on_startup(self):
+        pass
+
+    async def on_shutdown(self):
+        pass
+
+    def collect_metrics(self) -> List[Family]:
+        return registry.collect()
+
+    async def metrics(self, request: Request) -> Response:
+        response = request.make_response(status=200, body=render(self.collect_metrics()).encode())
+        response.headers = [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')]
+        return response
 
     async def http_request(self, request: Request, send: Coroutine) -> Response:
         exc = None
         response = Response(send, status=500)
+        handler_name = 'not_found'  # paths aren't used as labels, there is a token in the webhook path
         try:
-            handler = self.get_handler(request.path, request.method)
-            if not handler:
+            route = self.get_handler(request.path, request.method)
+            if not route:
                 response = Response(send, status=404, body=b'Not found')
                 return response
+            handler, args = route
+            handler_name = handler.__name__
             request.app = self
-            response_data = await handler(request)
+            response_data = await handler(*args, request)
             if isinstance(response_data, Response):
                 response = response_data
                 return response_data
@@ -152,32 +253,62 @@ class AsgiApplication:
                 ('content-length', len(response_data)),
             ]
             response.body = response_data
+        except RequestBodyTooLarge:
+            response.status = 413
+            response.body = b'Request body is too large'
+        except BadRequest:
+            response.status = 400
+            response.body = b'Bad request'
         except Exception:
             response.status = 500
             response.body = b'Internal wsgi app error'
             response.error = traceback.format_exc()
         finally:
-            self.__log_request(request, response, exc)
+            request_duration.observe(perf_counter() - request.start_time, handler=handler_name, status=response.status)
+            self.__log_request(request, response, handler_name, exc)
         return response
 
+    async def lifespan(self, receive: Coroutine, send: Coroutine):
+        while True:
+            message = await receive()
+            event = message['type'].removeprefix('lifespan.')
+            if event not in ('startup', 'shutdown'):
+                continue
+            try:
+                await (self.on_startup() if event == 'startup' else self.on_shutdown())
+            except Exception:
+                self.logger.fatal(f'Lifespan {event} failed', exc_info=True)
+                await send({'type': f'lifespan.{event}.failed', 'message': traceback.format_exc()})
+                return
+            await send({'type': f'lifespan.{event}.complete'})
+            if event == 'shutdown':
+                return
+
     async def __call__(self, scope: dict, receive: Coroutine, send: Coroutine):
-        request = Request(scope, receive, send)
-        await request.read()
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        request = Request(scope, receive, send, max_body_size=self.max_body_size)
         response = await self.http_request(request, send)
         await response.send()
 
-    def __log_request(self, request: Request, response: Response, error: str):
-        log_entry = {
-            'request': request.__to_dict__(),
-            'response': response.__to_dict__(),
-        }
+    def __log_request(self, request: Request, response: Response, handler_name: str, error: str):
         if error:
-            log_entry['exception'] = error
-            level = 'fatal'
+            level = logging.CRITICAL
         else:
-            first_digit = response.status // 100
-            error_level_map = {5: 'error', 4: 'warning'}
-            level = error_level_map.get(first_digit, 'info')
-        text = json.dumps(log_entry, indent=4)
-        log_method = getattr(self.logger, level)
-        log_method(text)
+            error_level_map = {5: logging.ERROR, 4: logging.WARNING}
+            level = error_level_map.get(response.status // 100, logging.INFO)
+        if not self.logger.isEnabledFor(level):
+            return
+        latency = (perf_counter() - request.start_time) * 1000
+        request_size = len(request.body or b'')
+        response_size = len(response.body or b'')
+        # Access log records have constant size, so logging is cheap for any request.
+        # The handler is logged instead of the path, there is a token in the webhook path
+        self.logger.log(level, '%s %s %d %.1fms %d/%d bytes', request.method, handler_name,
+                        response.status, latency, request_size, response_size)
+        if error or response.error:
+            self.logger.log(level, error or response.error)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            limit = self.max_logged_body_size
+            self.logger.debug('request body: %r, response body: %r',
+                              (request.body or b'')[:limit], (response.body or b'')[:limit])
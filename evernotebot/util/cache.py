@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+
+class LruCache:
+    '''
+    Least recently used cache. An item is also evicted if it hasn't been
+    accessed for `ttl` seconds.
+    '''
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()  # key -> (value, last access time)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.get(key)
+        now = monotonic()
+        if item is None or self._is_expired(item, now):
+            if item is not None:
+                self._evict(key)
+            self.misses += 1
+            return default
+        self._items[key] = (item[0], now)
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        now = monotonic()
+        if key in self._items:
+            del self._items[key]
+        self._items[key] = (value, now)
+        self.evict_expired(now)
+        while len(self._items) > self.max_size:
+            self._evict(next(iter(self._items)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self) -> None:
+        for key in list(self._items):
+            self._evict(key)
+
+    def evict_expired(self, now: Optional[float] = None) -> None:
+        if self.ttl is None:
+            return
+        now = now or monotonic()
+        while self._items:
+            key, item = next(iter(self._items.items()))
+            if not self._is_expired(item, now):
+                break
+            self._evict(key)
+
+    def _is_expired(self, item: tuple, now: float) -> bool:
+        return self.ttl is not None and now - item[1] > self.ttl
+
+    def _evict(self, key: Hashable) -> None:
+        value, _ = self._items.pop(key)
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from evernotebot.util.evernote.client import EvernoteApi
+
+
+logger = logging.getLogger('evernotebot')
+
+
+class _Batch:
+    def __init__(self, api: EvernoteApi):
+        self.api = api
+        self.fragments: List[dict] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # One handler per update that owns fragments of the batch
+        self.error_handlers: List[Callable[[Exception], Awaitable]] = []
+        self.saved_handlers: List[Callable[[], Awaitable]] = []
+
+    def add(self, fragment: dict, on_error: Optional[Callable[[Exception], Awaitable]] = None,
+            on_saved: Optional[Callable[[], Awaitable]] = None) -> None:
+        self.fragments.append(fragment)
+        if on_error is not None and on_error not in self.error_handlers:
+            self.error_handlers.append(on_error)
+        if on_saved is not None and on_saved not in self.saved_handlers:
+            self.saved_handlers.append(on_saved)
+
+
+class NoteAppendBuffer:
+    '''
+    Write-behind buffer for appends to a shared note ("One note" mode).
+    Text fragments are collected for `delay` seconds (or until there are
+    `max_fragments` of them) and written with a single `updateNote`.
+    Fragments with files are written immediately, after everything buffered
+    before them, because their temporary files may be removed right after.
+    A write is reported to `on_saved` or, if it failed, to `on_error` of
+    every update whose fragments it contained; without `on_error` a fragment
+    with files raises to its caller.
+    '''
+
+    def __init__(self, delay: float = 0.5, max_fragments: int = 20):
+        self.delay = delay
+        self.max_fragments = max_fragments
+        self._batches: Dict[str, _Batch] = {}
+        self._last_flush: Dict[str, asyncio.Task] = {}
+
+    async def append(self, api: EvernoteApi, note_id: str, fragment: dict,
+                     on_error: Optional[Callable[[Exception], Awaitable]] = None,
+                     on_saved: Optional[Callable[[], Awaitable]] = None) -> None:
+        if fragment.get('files') or self.delay <= 0:
+            self.flush(note_id)
+            batch = _Batch(api)
+            batch.add(fragment, on_error, on_saved)
+            await self._schedule(note_id, batch)
+            return
+        batch = self._batches.get(note_id)
+        if batch is None or batch.api is not api:
+            self.flush(note_id)
+            batch = _Batch(api)
+            batch.timer = asyncio.get_running_loop().call_later(self.delay, self.flush, note_id)
+            self._batches[note_id] = batch
+        batch.add(fragment, on_error, on_saved)
+        if len(batch.fragments) >= self.max_fragments:
+            self.flush(note_id)
+
+    def flush(self, note_id: str) -> Optional[asyncio.Task]:
+        batch = self._batches.pop(note_id, None)
+        if batch is None:
+            return None
+        batch.timer.cancel()
+        task = self._schedule(note_id, batch)
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # errors are logged by `_write`
+        return task
+
+    async def close(self) -> None:
+        for note_id in list(self._batches):
+            self.flush(note_id)
+        await asyncio.gather(*self._last_flush.values(), return_exceptions=True)
+
+    def _schedule(self, note_id: str, batch: _Batch) -> asyncio.Task:
+        # Batches of one note are written strictly one after another
+        previous = self._last_flush.get(note_id)
+        task = asyncio.create_task(self._write(note_id, batch, previous))
+        self._last_flush[note_id] = task
+
+        def forget(t: asyncio.Task):
+            if self._last_flush.get(note_id) is t:
+                del self._last_flush[note_id]
+
+        task.add_done_callback(forget)
+        return task
+
+    async def _write(self, note_id: str, batch: _Batch, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await batch.api.append_to_note(note_id, batch.fragments)
+        except Exception as e:
+            logger.error(f'Failed to append {len(batch.fragments)} fragments to note {note_id}', exc_info=True)
+            if not batch.error_handlers:
+                raise
+            for on_error in batch.error_handlers:
+                try:
+                    await on_error(e)
+                except Exception:
+                    logger.error(f'Failed to report an append error of note {note_id}', exc_info=True)
+            return
+        for on_saved in batch.saved_handlers:
+            try:
+                await on_saved()
+            except Exception:
+                logger.error(f'Failed to report an append to note {note_id}', exc_info=True)
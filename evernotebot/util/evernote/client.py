@@ -4,45 +4,95 @@ import functools
 import hashlib
 import json
 import mimetypes
+import mmap
+import os
 import re
 import urllib.parse
-from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from time import monotonic, time
+from typing import List, Optional
 
 import evernote.edam.type.ttypes as Types
 from evernote.api.client import EvernoteClient as EvernoteSdk
-from evernote.edam.error.ttypes import EDAMUserException
+from evernote.edam.error.ttypes import EDAMErrorCode, EDAMSystemException, EDAMUserException
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+
+from evernotebot.util.cache import LruCache
+from evernotebot.util.evernote.executor import SdkExecutor
+from evernotebot.util.metrics import registry
+
+
+call_duration = registry.histogram(
+    'evernote_api_call_duration_seconds', 'Time of Evernote API calls', labels=('method',))
+call_errors = registry.counter(
+    'evernote_api_errors_total', 'Failed Evernote API calls', labels=('method', 'error'))
 
 
 class EvernoteApiError(Exception):
     pass
 
 
+class BufferBinaryProtocol(TBinaryProtocol):
+    '''
+    TBinaryProtocol accepts only `bytes` for binary fields. This one also
+    writes memory-mapped files and memoryviews as they are, without a copy.
+    '''
+
+    def writeString(self, value):
+        if isinstance(value, (mmap.mmap, memoryview)):
+            self.writeI32(memoryview(value).nbytes)
+            self.trans.write(value)
+            return
+        super().writeString(value)
+
+
 class NoteContent:
     def __init__(self, content: str = ''):
         self.content = self.parse(content)
         self.resources = []
+        self._buffers = []  # memory-mapped files of the resources
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for buffer in self._buffers:
+            buffer.close()
+        self._buffers = []
 
     def parse(self, content: str):
-        matched = re.search(r"<en-note>(?P<content>.*)</en-note>", content)
+        matched = re.search(r"<en-note[^>]*>(?P<content>.*)</en-note>", content, re.DOTALL)
         if not matched:
             return ""
         return matched.group("content")
 
     def make_resource(self, file_info):
+        # The file is mapped to memory instead of being read, so the data
+        # is written to a request right from the page cache
         with open(file_info['path'], 'rb') as f:
-            data_bytes = f.read()
-        md5 = hashlib.md5()
-        md5.update(data_bytes)
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                data_bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._buffers.append(data_bytes)
+            else:
+                data_bytes = b''
+        if file_info.get('md5'):
+            md5_hex = file_info['md5']  # computed while downloading
+        else:
+            md5_hex = hashlib.md5(data_bytes).hexdigest()
 
         data = Types.Data()
-        data.size = len(data_bytes)
-        data.bodyHash = md5.digest()
+        data.size = size
+        data.bodyHash = bytes.fromhex(md5_hex)
         data.body = data_bytes
 
         name = file_info['name']
-        extension = name.split('.')[-1]
-        mime_type = mimetypes.types_map.get('.{}'.format(extension), 'application/octet-stream')
+        mime_type = file_info.get('mime_type')
+        if not mime_type:
+            extension = name.split('.')[-1]
+            mime_type = mimetypes.types_map.get('.{}'.format(extension), 'application/octet-stream')
         resource = Types.Resource()
         resource.mime = mime_type
         resource.data = data
@@ -50,7 +100,7 @@ class NoteContent:
         return {
             'resource': resource,
             'mime_type': mime_type,
-            'md5': md5.hexdigest(),
+            'md5': md5_hex,
         }
 
     def append(self, *, text='', html='', file=None):
@@ -118,42 +168,105 @@ def get_oauth_data(
 
 
 class EvernoteApi:
-    def __init__(self, access_token, sandbox=True):
+    def __init__(self, access_token, sandbox=True, executor: Optional[SdkExecutor] = None,
+                 user_info_ttl: float = 3600, quota_ttl: float = 300, notebooks_ttl: float = 600):
         self._token = access_token
         self._sdk = EvernoteSdk(token=access_token, sandbox=sandbox)
-        self._notes_store = self._sdk.get_note_store()
-        self.executor = ThreadPoolExecutor()
+        self._notes_store = None
+        self._user_store = None
+        self.user_info_ttl = user_info_ttl
+        self.quota_ttl = quota_ttl
+        self.notebooks_ttl = notebooks_ttl
+        self._user_info = None
+        self._user_info_updated = 0.0
+        self._uploaded = None  # bytes uploaded in the current period, see `getSyncState`
+        self._uploaded_updated = 0.0
+        self._notebooks = None  # {'updated': timestamp, 'items': [...]}, it's stored in the user document
+        self._notebooks_by_guid = {}
+        self._notebooks_by_name = {}
+        self._notes = LruCache(max_size=16)  # note guid -> last known content and updateSequenceNum
+        # Thrift clients aren't thread safe, the executor runs calls of one token one at a time
+        self.executor = executor or SdkExecutor(max_workers=1)
+
+    @property
+    def token(self) -> str:
+        return self._token
 
     async def async_run(self, callable, *args, **kwargs):
-        loop = asyncio.get_event_loop()
-        closure = functools.partial(callable, *args, **kwargs)
-        return await loop.run_in_executor(self.executor, closure)
+        return await self.executor.run(self._token, callable, *args, **kwargs)
 
     @staticmethod
-    async def get_access_token(app_key, app_secret, token, secret, verifier, sandbox=False):
+    async def get_access_token(app_key, app_secret, token, secret, verifier, sandbox=False,
+                               executor: Optional[SdkExecutor] = None):
         sdk = EvernoteSdk(consumer_key=app_key, consumer_secret=app_secret, sandbox=sandbox)
-        get_access_token = functools.partial(sdk.get_access_token, token, secret, verifier)
-        loop = asyncio.get_event_loop()
-        executor = ThreadPoolExecutor()
-        return await loop.run_in_executor(executor, get_access_token)
+        if executor is None:
+            get_access_token = functools.partial(sdk.get_access_token, token, secret, verifier)
+            return await asyncio.get_running_loop().run_in_executor(None, get_access_token)
+        return await executor.run(token, sdk.get_access_token, token, secret, verifier)
+
+    def _get_note_store(self):
+        if self._notes_store is None:
+            store = self._sdk.get_note_store()  # it makes a request to UserStore
+            # The SDK doesn't allow to choose a protocol, so it's replaced in the Thrift client
+            client = store._client
+            client._oprot = BufferBinaryProtocol(client._oprot.trans)
+            self._notes_store = store
+        return self._notes_store
+
+    def _get_user_store(self):
+        if self._user_store is None:
+            self._user_store = self._sdk.get_user_store()
+        return self._user_store
+
+    def _call_store(self, get_store, method, *args, **kwargs):
+        method = getattr(get_store(), method)
+        return method(*args, **kwargs)
 
     async def _note_store_call(self, method, *args, **kwargs):
+        return await self._store_call(self._get_note_store, method, *args, **kwargs)
+
+    async def _user_store_call(self, method, *args, **kwargs):
+        return await self._store_call(self._get_user_store, method, *args, **kwargs)
+
+    async def _store_call(self, get_store, method, *args, **kwargs):
         try:
-            method = getattr(self._notes_store, method)
-            return await self.async_run(method, *args, **kwargs)
+            with call_duration.time(method=method):  # including waiting for the executor
+                return await self.async_run(self._call_store, get_store, method, *args, **kwargs)
         except Exception as e:
+            call_errors.inc(method=method, error=type(e).__name__)
             if isinstance(e, EDAMUserException) and e.errorCode == 3 and e.parameter == 'authenticationToken':
                 raise EvernoteApiError('Invalid auth token')
+            if isinstance(e, EDAMSystemException) and e.errorCode == EDAMErrorCode.RATE_LIMIT_REACHED:
+                raise EvernoteApiError(f'Rate limit reached. Try again in {e.rateLimitDuration} seconds')
             raise EvernoteApiError()
 
     async def get_all_notebooks(self, query: dict = None) -> List[dict]:
-        notebooks = await self._note_store_call('listNotebooks')
-        notebooks = [{"guid": nb.guid, "name": nb.name} for nb in notebooks]
+        if self._notebooks is None or time() - self._notebooks['updated'] > self.notebooks_ttl:
+            notebooks = await self._note_store_call('listNotebooks')
+            self.load_notebooks({
+                'updated': time(),
+                'items': [{'guid': nb.guid, 'name': nb.name} for nb in notebooks],
+            })
         if not query:
-            return notebooks
-        return list(
-            filter(lambda nb: nb["guid"] == query.get("guid") or nb["name"] == query.get("name"), notebooks)
-        )
+            return list(self._notebooks['items'])
+        notebook = self._notebooks_by_guid.get(query.get('guid')) or self._notebooks_by_name.get(query.get('name'))
+        return [notebook] if notebook else []
+
+    @property
+    def notebooks(self) -> Optional[dict]:
+        return self._notebooks
+
+    def load_notebooks(self, notebooks: dict) -> None:
+        if self._notebooks is not None and self._notebooks['updated'] >= notebooks['updated']:
+            return
+        self._notebooks = notebooks
+        self._notebooks_by_guid = {nb['guid']: nb for nb in notebooks['items']}
+        self._notebooks_by_name = {nb['name']: nb for nb in notebooks['items']}
+
+    def invalidate_notebooks(self) -> None:
+        self._notebooks = None
+        self._notebooks_by_guid = {}
+        self._notebooks_by_name = {}
 
     async def get_default_notebook(self):
         notebook = await self._note_store_call('getDefaultNotebook')
@@ -166,60 +279,95 @@ class EvernoteApi:
         note = Types.Note()
         note.title = title and title.replace('\n', ' ') or ''  # Evernote doesn't support '\n' in titles
         note.notebookGuid = notebook_id
-        content = NoteContent()
-        content.append(text=text, html=kwargs.get("html"))
-        if "files" in kwargs:
-            list(map(lambda f: content.append(file=f), kwargs["files"]))
-        note.content = str(content)
-        note.resources = content.resources
-        created_note = await self._note_store_call('createNote', note)
+        with NoteContent() as content:
+            content.append(text=text, html=kwargs.get("html"))
+            if "files" in kwargs:
+                list(map(lambda f: content.append(file=f), kwargs["files"]))
+            note.content = str(content)
+            note.resources = content.resources
+            created_note = await self._note_store_call('createNote', note)
+        self.track_upload(len(note.content.encode()) + sum(r.data.size for r in note.resources))
         return created_note.guid
 
     async def update_note(self, note_id, text=None, title=None, **kwargs):
-        note = await self.get_note(note_id)
-        content = NoteContent(note.content)
-        content.append(text=text, html=kwargs.get('html'))
-        if 'files' in kwargs:
-            files = kwargs['files']
-            # We create new note for the files...
-            attachments_note_id = await self.create_note(note.notebookGuid, text='', title=title, files=files)
-            # ...and put a link to this note into original note
-            for file in files:
-                url = self.get_note_link(attachments_note_id)
-                link = f'<a href="{url}">{file["name"]}</a>'
-                content.append(html=link)
-        note.content = str(content)
-        return await self._note_store_call('updateNote', note)
-
-    async def get_note(self, note_guid):
-        with_content = True
-        with_resources_data = True,
-        with_resources_recognition = False,
+        return await self.append_to_note(note_id, [dict(kwargs, text=text, title=title)])
+
+    async def append_to_note(self, note_id, fragments: List[dict]):
+        note = await self.get_note(note_id, with_content=False)
+        content = NoteContent()
+        content.content = await self.get_note_body(note)
+        for fragment in fragments:
+            content.append(text=fragment.get('text'), html=fragment.get('html'))
+            if files := fragment.get('files'):
+                # We create new note for the files...
+                attachments_note_id = await self.create_note(note.notebookGuid, text='',
+                                                             title=fragment.get('title'), files=files)
+                # ...and put a link to this note into original note
+                url = await self.get_note_link(attachments_note_id)
+                for file in files:
+                    link = f'<a href="{url}">{file["name"]}</a>'
+                    content.append(html=link)
+        # Only the content is sent. Resources of the note stay untouched when `resources` is unset
+        update = Types.Note(guid=note.guid, title=note.title, content=str(content))
+        updated_note = await self._note_store_call('updateNote', update)
+        self.track_upload(len(update.content.encode()))
+        self._notes.set(note_id, {'content': content.content, 'usn': updated_note.updateSequenceNum})
+        return updated_note
+
+    async def get_note_body(self, note) -> str:
+        cached = self._notes.get(note.guid)
+        if cached and cached['usn'] == note.updateSequenceNum:
+            return cached['content']
+        enml = await self._note_store_call('getNoteContent', note.guid)
+        body = NoteContent(enml).content
+        self._notes.set(note.guid, {'content': body, 'usn': note.updateSequenceNum})
+        return body
+
+    async def get_note(self, note_guid, with_content=True, with_resources_data=False):
+        with_resources_recognition = False
         with_resources_alternate_data = False
         return await self._note_store_call('getNote', note_guid, with_content,
-                                     with_resources_data, with_resources_recognition,
-                                     with_resources_alternate_data)
-
-    def get_note_link(self, note_guid, app_link=False):
-        user_store = self._sdk.get_user_store()
-        user = user_store.getUser(self._token)
-        user_id = user.id
-        user = {"id": user_id, "shard_id": user.shardId}
+                                           with_resources_data, with_resources_recognition,
+                                           with_resources_alternate_data)
+
+    async def get_user_info(self) -> dict:
+        # `uploadLimitEnd` is in ms. The limits change when a new upload period starts
+        expired = self._user_info and self._user_info['upload_limit_end'] / 1000.0 < time()
+        if self._user_info is None or expired or monotonic() - self._user_info_updated > self.user_info_ttl:
+            user = await self._user_store_call('getUser')
+            self._user_info = {
+                'id': user.id,
+                'shard_id': user.shardId,
+                'upload_limit': user.accounting.uploadLimit,
+                'upload_limit_end': user.accounting.uploadLimitEnd,
+            }
+            self._user_info_updated = monotonic()
+            if expired:
+                self._uploaded = None
+        return self._user_info
+
+    async def get_note_link(self, note_guid, app_link=False):
+        user = await self.get_user_info()
+        user_id = user['id']
         service = self._sdk.service_host
-        shard = user["shard_id"]
+        shard = user['shard_id']
         if app_link:
             return f"evernote:///view/{user_id}/{shard}/{note_guid}/{note_guid}/"
         return f"https://{service}/shard/{shard}/nl/{user_id}/{note_guid}/"
 
+    def track_upload(self, size: int):
+        # Keep the quota up to date between `getSyncState` requests. `size` is in bytes, like the quota
+        if self._uploaded is not None:
+            self._uploaded += size
+
     async def get_quota_info(self):
-        user_store = self._sdk.get_user_store()
-        user = user_store.getUser()
-        state = await self._note_store_call('getSyncState')
-        total_monthly_quota = user.accounting.uploadLimit
-        used_so_far = state.uploaded
-        quota_remaining = total_monthly_quota - used_so_far
-        reset_date = datetime.datetime.fromtimestamp(
-            user.accounting.uploadLimitEnd / 1000.0)
+        user = await self.get_user_info()
+        if self._uploaded is None or monotonic() - self._uploaded_updated > self.quota_ttl:
+            state = await self._note_store_call('getSyncState')
+            self._uploaded = state.uploaded
+            self._uploaded_updated = monotonic()
+        quota_remaining = user['upload_limit'] - self._uploaded
+        reset_date = datetime.datetime.fromtimestamp(user['upload_limit_end'] / 1000.0)
         return {
             'remaining': quota_remaining,
             'reset_date': reset_date,
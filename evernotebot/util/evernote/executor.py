@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Callable, Dict, Hashable
+
+
+logger = logging.getLogger('evernotebot')
+
+
+class SdkExecutor:
+    '''
+    Runs blocking Evernote SDK (Thrift) calls in a bounded thread pool.
+    Calls of a single key (user) run one at a time: Thrift clients of a user
+    aren't thread safe, and one busy user doesn't starve the others.
+    '''
+
+    def __init__(self, max_workers: int = 16):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evernote')
+        self._user_slots: Dict[Hashable, asyncio.Lock] = {}
+        self._user_refs: Dict[Hashable, int] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.closed = False
+        self.pending = 0
+        self.running = 0  # submitted to the thread pool, including the queued ones
+        self.queued = 0  # waiting for a free thread
+        self._queued_lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    async def run(self, key: Hashable, func: Callable, *args, **kwargs):
+        if self.closed:
+            raise Exception('Evernote executor is shut down')
+        loop = asyncio.get_running_loop()
+        timings = {}
+
+        def call():
+            self._dequeue(timings)
+            timings['start'] = monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timings['end'] = monotonic()
+
+        slot = self._acquire_slot(key)
+        self.pending += 1
+        self._idle.clear()
+        queued_at = monotonic()
+        try:
+            async with slot:
+                self.running += 1
+                with self._queued_lock:
+                    self.queued += 1
+                    timings['queued'] = True
+                try:
+                    return await loop.run_in_executor(self._executor, call)
+                except Exception:
+                    self.errors += 1
+                    raise
+                finally:
+                    self._dequeue(timings)  # the call is cancelled before a thread took it
+                    self.running -= 1
+        finally:
+            self.pending -= 1
+            self._release_slot(key)
+            self._record(queued_at, timings)
+            if not self.pending:
+                self._idle.set()
+
+    def _dequeue(self, timings: dict) -> None:
+        with self._queued_lock:
+            if timings.pop('queued', False):
+                self.queued -= 1
+
+    def _acquire_slot(self, key: Hashable) -> asyncio.Lock:
+        slot = self._user_slots.get(key)
+        if slot is None:
+            slot = asyncio.Lock()
+            self._user_slots[key] = slot
+            self._user_refs[key] = 0
+        self._user_refs[key] += 1
+        return slot
+
+    def _release_slot(self, key: Hashable) -> None:
+        self._user_refs[key] -= 1
+        if not self._user_refs[key]:
+            del self._user_refs[key]
+            del self._user_slots[key]
+
+    def _record(self, queued_at: float, timings: dict) -> None:
+        self.calls += 1
+        start = timings.get('start')
+        if start is None:
+            return
+        wait_time = start - queued_at
+        run_time = timings.get('end', start) - start
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        self.total_run_time += run_time
+        self.max_run_time = max(self.max_run_time, run_time)
+
+    async def shutdown(self, timeout: float = 30.0) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'{self.pending} Evernote calls are not finished in {timeout} seconds')
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def stats(self) -> dict:
+        calls = self.calls or 1
+        return {
+            'max_workers': self.max_workers,
+            'waiting_for_user': self.pending - self.running,  # calls behind another call of the same user
+            'queued': self.queued,
+            'running': self.running - self.queued,
+            'calls': self.calls,
+            'errors': self.errors,
+            'avg_wait_time': self.total_wait_time / calls,
+            'max_wait_time': self.max_wait_time,
+            'avg_run_time': self.total_run_time / calls,
+            'max_run_time': self.max_run_time,
+        }
@@ -0,0 +1,99 @@
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from os.path import join
+from typing import Optional
+
+
+logger = logging.getLogger('evernotebot')
+
+
+def link_file(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)  # the same data without a copy
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class FileCache:
+    '''
+    Downloaded files by a content key (Telegram's `file_unique_id` is the
+    same for every copy of a file). Least recently used files are removed
+    when the total size exceeds `max_size` bytes.
+    Files are handed out as hard links, so a file removed from the cache
+    stays available to whoever got it before.
+    '''
+
+    def __init__(self, root: str, max_size: int = 256 * 1024 * 1024):
+        self.root = root
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # key -> file info
+        os.makedirs(root, exist_ok=True)
+        # There is no index of the files stored by a previous process
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str, path: str) -> Optional[dict]:
+        '''
+        Puts a cached file to `path` and returns its info (size, md5, etc.)
+        '''
+        file_info = self._items.get(key)
+        if file_info is None:
+            self.misses += 1
+            return None
+        try:
+            link_file(file_info['path'], path)
+        except OSError:
+            logger.warning(f'Cached file {file_info["path"]} is lost', exc_info=True)
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return dict(file_info, path=path)
+
+    def put(self, key: str, file_info: dict) -> None:
+        if key in self._items or file_info['size'] > self.max_size:
+            return
+        if not key.replace('-', '').replace('_', '').isalnum():
+            return  # it's used as a file name
+        path = join(self.root, key)
+        try:
+            link_file(file_info['path'], path)
+        except OSError:
+            logger.warning(f'Failed to cache file {file_info["path"]}', exc_info=True)
+            return
+        self._items[key] = dict(file_info, path=path)
+        self.size += file_info['size']
+        while self.size > self.max_size:
+            self._remove(next(iter(self._items)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        file_info = self._items.pop(key)
+        self.size -= file_info['size']
+        try:
+            os.unlink(file_info['path'])
+        except FileNotFoundError:
+            pass
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'files': len(self._items),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
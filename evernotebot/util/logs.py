@@ -1,7 +1,14 @@
+import atexit
 import json
 import logging.config
 from logging import Formatter
+from logging.handlers import QueueHandler, QueueListener
 from os.path import join
+from queue import SimpleQueue
+from typing import Iterable, Optional
+
+
+_listener: Optional[QueueListener] = None
 
 
 class JsonFormatter(Formatter):
@@ -14,6 +21,7 @@ class JsonFormatter(Formatter):
 
 
 def init_logging(logs_dir: str, debug=False):
+    level = 'DEBUG' if debug else 'INFO'
     config = {
         'version': 1,
         'disable_existing_loggers': False,
@@ -43,20 +51,49 @@ def init_logging(logs_dir: str, debug=False):
         },
         'loggers': {
             'wsgi': {
-                'level': 'DEBUG',
+                'level': level,
                 'propagate': False,
                 'handlers': ['evernotebot'],
             },
             'evernotebot': {
-                'level': 'DEBUG',
+                'level': level,
                 'propagate': False,
                 'handlers': ['evernotebot'],
             },
             'telegram.api': {
-                'level': 'DEBUG',
+                'level': level,
                 'propagate': False,
                 'handlers': ['evernotebot'],
             },
         },
     }
     logging.config.dictConfig(config)
+    start_queue_listener(config['loggers'])
+
+
+def start_queue_listener(logger_names: Iterable[str]) -> None:
+    '''
+    Moves handlers of the loggers to a background thread, so the event loop
+    only puts records to a queue and never waits for I/O.
+    '''
+    global _listener
+    stop_queue_listener()
+    queue = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    handlers = []
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+        logger.handlers = [queue_handler]
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def stop_queue_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # it writes the records left in the queue
+        _listener = None
@@ -0,0 +1,214 @@
+import math
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# A metric family is a plain dict, so families can be sent between processes:
+# {'name': str, 'type': str, 'help': str, 'samples': [(name, labels, value)]}
+Family = dict
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}  # label values -> value
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self.label_names) or not all(name in labels for name in self.label_names):
+            raise ValueError(f'Metric `{self.name}` has labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.label_names, key))
+
+    def samples(self) -> List[tuple]:
+        return [(self.name, self._labels(key), value) for key, value in self._values.items()]
+
+    def collect(self) -> Family:
+        return {'name': self.name, 'type': self.type, 'help': self.documentation, 'samples': self.samples()}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # bucket counts, sum, count
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def get(self, **labels) -> Tuple[float, int]:
+        '''
+        Returns the sum and the count of observed values
+        '''
+        state = self._values.get(self._key(labels))
+        return (state[1], state[2]) if state else (0.0, 0)
+
+    def samples(self) -> List[tuple]:
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append((f'{self.name}_bucket', dict(labels, le=format_value(bound)), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, count))
+        return samples
+
+
+class Registry:
+    '''
+    Metrics of the process. Metrics are updated from the event loop thread,
+    so there are no locks.
+    '''
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _get_or_create(self, metric_class: type, name: str, *args, **kwargs) -> Metric:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = metric_class(name, *args, **kwargs)
+        elif not isinstance(metric, metric_class):
+            raise ValueError(f'Metric `{name}` is a {metric.type}')
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+    def collect(self) -> List[Family]:
+        return [metric.collect() for metric in self._metrics.values()]
+
+
+registry = Registry()
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def add_labels(families: Iterable[Family], **labels) -> List[Family]:
+    return [
+        dict(family, samples=[(name, dict(sample_labels, **labels), value)
+                              for name, sample_labels, value in family['samples']])
+        for family in families
+    ]
+
+
+def stats_families(prefix: str, stats: dict, labels: Optional[dict] = None) -> List[Family]:
+    '''
+    Gauges of numbers in a `stats` dict (see `stats` of UpdateQueue,
+    SdkExecutor, etc.). Nested dicts make name prefixes, lists of dicts make
+    an `index` label.
+    '''
+    labels = labels or {}
+    families = []
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, dict):
+            families.extend(stats_families(name, value, labels))
+        elif isinstance(value, (list, tuple)):
+            for position, item in enumerate(value):
+                if isinstance(item, dict):
+                    item_labels = dict(labels, index=item.get('index', position))
+                    item = {k: v for k, v in item.items() if k != 'index'}
+                    families.extend(stats_families(name, item, item_labels))
+        elif isinstance(value, (int, float)):
+            families.append({'name': name, 'type': 'gauge', 'help': '', 'samples': [(name, labels, float(value))]})
+    return families
+
+
+def render(families: Iterable[Family]) -> str:
+    '''
+    Prometheus text format. Families of the same name are merged.
+    '''
+    merged: Dict[str, Family] = {}
+    for family in families:
+        if family['name'] in merged:
+            merged[family['name']]['samples'].extend(family['samples'])
+        else:
+            merged[family['name']] = dict(family, samples=list(family['samples']))
+    lines = []
+    for name, family in merged.items():
+        if family['help']:
+            lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        for sample_name, labels, value in family['samples']:
+            lines.append(f'{sample_name}{format_labels(labels)} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
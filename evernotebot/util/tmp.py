@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import shutil
+from os.path import join
+from time import time
+from typing import List, Optional, Set
+from uuid import uuid4
+
+
+logger = logging.getLogger('evernotebot')
+
+
+class TmpScope:
+    '''
+    Temporary files of one update. They are removed by `cleanup()`.
+    '''
+
+    def __init__(self, manager: 'TmpFileManager'):
+        self.manager = manager
+        self.id = uuid4().hex
+        self.paths: List[str] = []
+
+    def path(self, name: str) -> str:
+        path = join(self.manager.root, f'{self.id}_{name}')
+        self.paths.append(path)
+        self.manager.active.add(path)
+        return path
+
+    def cleanup(self) -> None:
+        for path in self.paths:
+            self.manager.remove(path)
+        self.paths = []
+
+
+class TmpFileManager:
+    '''
+    Keeps `root` directory small. Files of an update scope are removed when
+    the update is processed. Files left by crashed processes are removed in
+    background if they are older than `max_age` seconds, or (oldest first)
+    when the directory grows over `max_size` bytes.
+    '''
+
+    def __init__(self, root: str, max_age: float = 3600, max_size: int = 1024 ** 3, sweep_interval: float = 300):
+        self.root = root
+        self.max_age = max_age
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.active: Set[str] = set()
+        self.removed_files = 0
+        self.removed_bytes = 0
+        self.swept_files = 0
+        self.swept_bytes = 0
+        self.files = 0
+        self.size = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def scope(self) -> TmpScope:
+        return TmpScope(self)
+
+    def remove(self, path: str) -> None:
+        self.active.discard(path)
+        try:
+            size = os.stat(path).st_size
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        self.removed_files += 1
+        self.removed_bytes += size
+
+    def sweep(self) -> None:
+        now = time()
+        files = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False) or entry.path in self.active:
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total_size = sum(size for _, size, _ in files) + self._active_size()
+        kept = 0
+        for mtime, size, path in files:
+            if now - mtime > self.max_age or total_size > self.max_size:
+                if self._sweep_file(path, size):
+                    total_size -= size
+                    continue
+            kept += 1
+        self.files = kept + len(self.active)
+        self.size = total_size
+
+    def _active_size(self) -> int:
+        size = 0
+        for path in list(self.active):
+            try:
+                size += os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _sweep_file(self, path: str, size: int) -> bool:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return True
+        except OSError as e:
+            logger.warning(f'Failed to remove temporary file {path}: {e}')
+            return False
+        self.swept_files += 1
+        self.swept_bytes += size
+        return True
+
+    async def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self) -> None:
+        if self._sweeper is None:
+            return
+        self._sweeper.cancel()
+        try:
+            await self._sweeper
+        except asyncio.CancelledError:
+            pass
+        self._sweeper = None
+
+    async def _sweep_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.sweep)
+            except Exception:
+                logger.error('Temporary files sweep failed', exc_info=True)
+            await asyncio.sleep(self.sweep_interval)
+
+    @property
+    def stats(self) -> dict:
+        disk = shutil.disk_usage(self.root)
+        return {
+            'files': self.files,
+            'size': self.size,
+            'max_size': self.max_size,
+            'active_files': len(self.active),
+            'removed_files': self.removed_files,
+            'removed_bytes': self.removed_bytes,
+            'swept_files': self.swept_files,
+            'swept_bytes': self.swept_bytes,
+            'disk_total': disk.total,
+            'disk_free': disk.free,
+        }
@@ -1,9 +1,7 @@
 import asyncio
-import traceback
 
 from evernotebot.bot import EvernoteBot
-from evernotebot.bot.api import BotApiError
-from evernotebot.bot.errors import EvernoteBotException
+from evernotebot.bot.queue import UpdateQueueFull
 from evernotebot.util.asgi import Request
 
 
@@ -23,9 +21,12 @@ async def telegram_hook(request: Request):
     if data:
         bot: EvernoteBot = request.app.bot
         try:
-            await bot.process_update(data)
-        except BotApiError as e:
-            bot.logger.error(f'{traceback.format_exc()} {e}')
+            bot.enqueue_update(data)
+        except UpdateQueueFull as e:
+            bot.logger.warning(f'{e}. Update {data.get("update_id")} is rejected')
+            response = request.make_response(status=503, body=b'queue is full')
+            response.headers = [(b'retry-after', b'1')]
+            return response
         return 'ok'
     return 'request body is empty'
 
@@ -38,8 +39,5 @@ async def evernote_oauth(request: Request):
     if access_type not in {'readonly', 'readwrite'}:
         raise Exception(f'Invalid access type {access_type}')
     verifier = params.get('oauth_verifier')
-    try:
-        await bot.evernote_auth(callback_key, access_type, verifier)
-    except EvernoteBotException as e:
-        await bot.send_message(e.message)
+    await bot.oauth_callback(callback_key, access_type, verifier)
     return request.make_response(status=302, body=bot.url.encode())
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+'''
+Load test of the webhook: EvernoteBotApplication is driven in process with
+synthetic updates, Telegram Bot API and Evernote are faked.
+With `--mode polling` the updates are received by `getUpdates` instead.
+
+    python3 -m tests.benchmark --updates 5000 --users 200 --output benchmark.json
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess  # nosec
+import sys
+import tempfile
+from time import perf_counter, time
+from types import SimpleNamespace
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def latency_stats(values: list) -> dict:
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values, default=0.0),
+    }
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)  # nosec
+        return out.stdout.strip()
+    except OSError:
+        return ''
+
+
+class UpdateFactory:
+    '''
+    Updates of `users` users: texts, photos, documents and commands.
+    Photos and documents are picked from `distinct_files` files, so some
+    of them are repeated like forwarded files are.
+    '''
+
+    def __init__(self, users: int, one_note_ratio: float, distinct_files: int, seed: int):
+        self.random = random.Random(seed)
+        self.users = [
+            SimpleNamespace(id=user_id, chat_id=user_id * 10,
+                            mode='one_note' if self.random.random() < one_note_ratio else 'multiple_notes')
+            for user_id in range(1, users + 1)
+        ]
+        self.distinct_files = distinct_files
+        self.update_id = 0
+        self.message_id = 0
+
+    def make(self, count: int) -> list:
+        updates = []
+        while len(updates) < count:
+            user = self.random.choice(self.users)
+            kind = self.random.choices(('text', 'photo', 'document', 'command'), (60, 15, 10, 15))[0]
+            if kind == 'command':
+                if self.random.random() < 0.5:
+                    updates.append(self.command(user, '/help'))
+                else:
+                    updates.append(self.command(user, '/notebook'))
+                    updates.append(self.message(user, text=self.random.choice(('Default', 'Work'))))
+            elif kind == 'photo':
+                file = self.file()
+                updates.append(self.message(user, photo=[file], caption='photo'))
+            elif kind == 'document':
+                file = dict(self.file(), file_name='document.pdf')
+                updates.append(self.message(user, document=file))
+            else:
+                text = ' '.join(self.random.choices(('note', 'evernote', 'bot', 'text', 'telegram'), k=20))
+                updates.append(self.message(user, text=text))
+        return updates[:count]
+
+    def file(self) -> dict:
+        number = self.random.randrange(self.distinct_files)
+        self.message_id += 1
+        return {
+            'file_id': f'file-{number}-{self.message_id}',  # file_id differs for every message
+            'file_unique_id': f'file-{number}',
+            'file_size': 64 * 1024,
+        }
+
+    def message(self, user, **fields) -> dict:
+        self.update_id += 1
+        self.message_id += 1
+        return {
+            'update_id': self.update_id,
+            'message': dict({
+                'message_id': self.message_id,
+                'from': {'id': user.id, 'is_bot': False, 'first_name': f'User {user.id}'},
+                'chat': {'id': user.chat_id, 'type': 'private'},
+                'date': int(time()),
+            }, **fields),
+        }
+
+    def command(self, user, command: str) -> dict:
+        entities = [{'offset': 0, 'length': len(command), 'type': 'bot_command'}]
+        return self.message(user, text=command, entities=entities)
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.factory = UpdateFactory(args.users, args.one_note_ratio, args.distinct_files, args.seed)
+        self.webhook_latency = []
+        self.processing_latency = []
+        self.rejected = 0
+        self.failed = 0
+        self._sent_at = {}
+        self._processed = 0
+        self._all_processed = asyncio.Event()
+
+    def configure(self, bot_api_url: str) -> None:
+        os.environ.update({
+            'TELEGRAM_API_TOKEN': 'benchmark',
+            'BOT_API_URL': bot_api_url,
+            'TMP_ROOT': os.path.join(self.tmp_dir.name, 'tmp'),
+            'EVERNOTEBOT_STORAGE_PROVIDER': 'evernotebot.storage.providers.sqlite.AsyncSqlite',
+            'EVERNOTEBOT_STORAGE_DIR': os.path.join(self.tmp_dir.name, 'storage'),
+            'EVERNOTEBOT_QUEUE_WORKERS': str(self.args.workers),
+            'TELEGRAM_UPDATES_MODE': self.args.mode,
+            'TELEGRAM_POLLING_CONCURRENCY': str(self.args.workers),
+        })
+
+    async def setup(self):
+        from evernotebot.app import EvernoteBotApplication
+        from tests.evernote.store import FakeEvernote
+        from tests.telegram.fake_bot_api import FakeBotApi
+
+        self.bot_api = FakeBotApi(file_size=self.args.file_size)
+        await self.bot_api.start()
+        self.configure(self.bot_api.url)
+        self.app = EvernoteBotApplication()
+        for name in ('wsgi', 'evernotebot', 'telegram.api'):
+            logging.getLogger(name).setLevel(logging.CRITICAL)  # failures are counted in the results
+        args = self.args
+        self.evernote = FakeEvernote(
+            latency=(args.evernote_latency / 2, args.evernote_latency * 1.5) if args.evernote_latency else 0.0,
+            error_rate=args.evernote_error_rate,
+            rate_limit=args.evernote_rate_limit and (args.evernote_rate_limit, 60.0),
+            seed=args.seed,
+        )
+        bot = self.app.bot
+        get_evernote_api = bot.get_evernote_api
+
+        def get_fake_evernote_api(token):
+            api = get_evernote_api(token)
+            self.evernote.install(api)
+            return api
+
+        bot.get_evernote_api = get_fake_evernote_api
+        receiver = bot.poller if self.args.mode == 'polling' else bot.updates
+        handler = receiver.handler
+
+        async def timed_handler(update):
+            try:
+                await handler(update)
+            finally:
+                self.processing_latency.append(perf_counter() - self._sent_at[update['update_id']])
+                self._processed += 1
+                if self._processed == self.args.updates:
+                    self._all_processed.set()
+
+        receiver.handler = timed_handler
+        create_failed_update = bot.failed_updates.create
+
+        async def count_failed(data):
+            self.failed += 1
+            return await create_failed_update(data)
+
+        bot.failed_updates.create = count_failed
+        await self.app.on_startup()
+        await self.create_users()
+
+    async def create_users(self):
+        bot = self.app.bot
+        for user in self.factory.users:
+            note_guid = f'shared-{user.id}'
+            self.evernote.add_note(note_guid, 'Telegram bot notes')
+            await bot._users.create({
+                'id': user.id,
+                'user_id': user.id,
+                'chat_id': user.chat_id,
+                'first_name': f'User {user.id}',
+                'created': time(),
+                'bot_mode': user.mode,
+                'evernote': {
+                    'access': 'readwrite',
+                    'access_token': f'token-{user.id}',
+                    'notebook': {'name': 'Default', 'guid': 'nb-default'},
+                    'shared_note_id': note_guid,
+                },
+            })
+
+    async def post_update(self, update: dict) -> None:
+        body = json.dumps(update).encode()
+        path = f'/{self.app.config["telegram"]["token"]}'
+        while True:
+            scope = {
+                'type': 'http',
+                'method': 'POST',
+                'path': path,
+                'query_string': b'',
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+            }
+            status = {}
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status['code'] = message['status']
+
+            started = perf_counter()
+            self._sent_at[update['update_id']] = started
+            await self.app(scope, receive, send)
+            if status['code'] != 503:
+                self.webhook_latency.append(perf_counter() - started)
+                return
+            self.rejected += 1  # the queue is full, Telegram would retry later
+            await asyncio.sleep(0.05)
+
+    async def run(self) -> dict:
+        await self.setup()
+        updates = self.factory.make(self.args.updates)
+        streams = [[] for _ in range(self.args.concurrency)]
+        for update in updates:
+            # Updates of one chat are sent one by one, like Telegram does
+            streams[update['message']['chat']['id'] % len(streams)].append(update)
+
+        async def send_stream(stream):
+            for update in stream:
+                await self.post_update(update)
+
+        started = perf_counter()
+        if self.args.mode == 'polling':
+            self._sent_at = dict.fromkeys((update['update_id'] for update in updates), started)
+            self.bot_api.add_updates(updates)  # a backlog waiting for the bot
+        else:
+            await asyncio.gather(*(send_stream(stream) for stream in streams))
+        sent = perf_counter()
+        try:
+            await asyncio.wait_for(self._all_processed.wait(), self.args.timeout or None)
+        except asyncio.TimeoutError:
+            message = f'{self._processed} of {self.args.updates} updates are processed in {self.args.timeout} seconds'
+            await asyncio.wait_for(self.app.on_shutdown(), 10)  # stops threads, so the process can exit
+            self.tmp_dir.cleanup()
+            raise TimeoutError(message) from None
+        processed = perf_counter()
+        bot = self.app.bot
+        queue_stats = dict(bot.poller.stats if self.args.mode == 'polling' else bot.updates.stats)
+        await self.app.on_shutdown()
+        self.tmp_dir.cleanup()
+        return self.report(started, sent, processed, queue_stats)
+
+    def report(self, started: float, sent: float, processed: float, queue_stats: dict) -> dict:
+        count = self.args.updates
+        bot_api_calls = dict(self.bot_api.calls)
+        evernote_calls = dict(self.evernote.calls)
+        return {
+            'revision': git_revision(),
+            'timestamp': time(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'parameters': vars(self.args),
+            'results': {
+                'updates': count,
+                'duration': processed - started,
+                'send_duration': sent - started,
+                'throughput': count / (processed - started),
+                'webhook_latency': latency_stats(self.webhook_latency),
+                'processing_latency': latency_stats(self.processing_latency),
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'error_messages': self.bot_api.error_messages,
+                'bot_api_calls_per_update': sum(bot_api_calls.values()) / count,
+                'bot_api_calls': bot_api_calls,
+                'downloads': self.bot_api.downloads,
+                'evernote_calls_per_update': sum(evernote_calls.values()) / count,
+                'evernote_calls': evernote_calls,
+                'evernote_errors': dict(self.evernote.errors),
+                'queue': queue_stats,
+                'rss': current_rss(),
+                'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            },
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Webhook load test')
+    parser.add_argument('--mode', choices=('webhook', 'polling'), default='webhook')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50, help='updates sent at once')
+    parser.add_argument('--workers', type=int, default=64, help='update queue workers (chats at once when polling)')
+    parser.add_argument('--one-note-ratio', type=float, default=0.3, help='share of users in `One note` mode')
+    parser.add_argument('--distinct-files', type=int, default=50)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--evernote-latency', type=float, default=0.0, help='mean Evernote call time, seconds')
+    parser.add_argument('--evernote-error-rate', type=float, default=0.0)
+    parser.add_argument('--evernote-rate-limit', type=int, default=0, help='Evernote calls per minute per user')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds to wait for processing, 0 - forever')
+    parser.add_argument('--output', default='benchmark.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    environ = dict(os.environ)
+    try:
+        report = asyncio.run(Benchmark(args).run())
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    results = report['results']
+    latency = results['webhook_latency']
+    print(f'{results["updates"]} updates in {results["duration"]:.2f}s, '
+          f'{results["throughput"]:.1f} updates/s, webhook p50/p95/p99: '
+          f'{latency["p50"] * 1000:.2f}/{latency["p95"] * 1000:.2f}/{latency["p99"] * 1000:.2f} ms, '
+          f'{results["bot_api_calls_per_update"]:.2f} Bot API calls per update. Results: {args.output}')
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+from collections import Counter, deque
+from copy import copy
+from itertools import count
+from typing import Optional, Tuple, Union
+
+import evernote.edam.type.ttypes as Types
+from evernote.edam.error.ttypes import EDAMErrorCode, EDAMNotFoundException, EDAMSystemException
+from evernote.edam.notestore.ttypes import SyncState
+
+
+class FakeEvernote:
+    '''
+    In-memory Evernote service at the SDK level: NoteStore and UserStore
+    objects with the methods `EvernoteApi` calls. They are installed instead
+    of the Thrift clients of the SDK (see `install()`).
+
+    `latency` is seconds per call (a number or a (min, max) range).
+    `error_rate` is a share of calls failed with INTERNAL_ERROR.
+    `rate_limit` is (calls, seconds) allowed per access token, calls over
+    the limit fail with RATE_LIMIT_REACHED like the real service does.
+    '''
+
+    def __init__(self, latency: Union[float, Tuple[float, float]] = 0.0, error_rate: float = 0.0,
+                 rate_limit: Optional[Tuple[int, float]] = None, upload_limit: int = 10 * 1024 ** 3,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.upload_limit = upload_limit
+        self.calls = Counter()
+        self.errors = Counter()
+        self.notes = {}
+        self.contents = {}
+        self.notebooks = [
+            Types.Notebook(guid='nb-default', name='Default', defaultNotebook=True),
+            Types.Notebook(guid='nb-work', name='Work', defaultNotebook=False),
+        ]
+        self.uploaded = 0
+        self._usn = count(1)
+        self._guids = count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._token_calls = {}  # token -> times of the recent calls
+
+    def install(self, api) -> None:
+        api._notes_store = FakeStore(self, api.token, {
+            'listNotebooks': self.listNotebooks,
+            'getDefaultNotebook': self.getDefaultNotebook,
+            'createNote': self.createNote,
+            'getNote': self.getNote,
+            'getNoteContent': self.getNoteContent,
+            'updateNote': self.updateNote,
+            'getSyncState': self.getSyncState,
+        })
+        api._user_store = FakeStore(self, api.token, {'getUser': self.getUser})
+
+    def add_note(self, guid: str, title: str, notebook_guid: str = 'nb-default', content: str = '') -> Types.Note:
+        note = Types.Note(guid=guid, title=title, notebookGuid=notebook_guid, updateSequenceNum=next(self._usn))
+        self.notes[guid] = note
+        self.contents[guid] = content or '<en-note></en-note>'
+        return note
+
+    def before_call(self, token: str, name: str) -> None:
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = self._random.uniform(*latency)
+        if latency:
+            time.sleep(latency)  # SDK calls are blocking, they are made in threads
+        with self._lock:
+            self.calls[name] += 1
+            if self.rate_limit:
+                max_calls, period = self.rate_limit
+                now = time.monotonic()
+                calls = self._token_calls.setdefault(token, deque())
+                while calls and now - calls[0] > period:
+                    calls.popleft()
+                if len(calls) >= max_calls:
+                    self.errors['RATE_LIMIT_REACHED'] += 1
+                    duration = int(period - (now - calls[0])) + 1
+                    raise EDAMSystemException(EDAMErrorCode.RATE_LIMIT_REACHED, rateLimitDuration=duration)
+                calls.append(now)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors['INTERNAL_ERROR'] += 1
+                raise EDAMSystemException(EDAMErrorCode.INTERNAL_ERROR, message='Injected error')
+
+    def get_note(self, guid: str) -> Types.Note:
+        note = self.notes.get(guid)
+        if note is None:
+            raise EDAMNotFoundException(identifier='Note.guid', key=guid)
+        return note
+
+    def listNotebooks(self):
+        return [copy(nb) for nb in self.notebooks]
+
+    def getDefaultNotebook(self):
+        return copy(self.notebooks[0])
+
+    def createNote(self, note):
+        with self._lock:
+            guid = f'note-{next(self._guids)}'
+            size = len(note.content or '') + sum(r.data.size for r in note.resources or ())
+            if self.uploaded + size > self.upload_limit:
+                raise EDAMSystemException(EDAMErrorCode.QUOTA_REACHED)
+            self.uploaded += size
+        created = self.add_note(guid, note.title, note.notebookGuid, note.content)
+        created.resources = [Types.Resource(mime=r.mime, attributes=r.attributes,
+                                            data=Types.Data(size=r.data.size, bodyHash=r.data.bodyHash))
+                             for r in note.resources or ()]  # the data itself isn't kept
+        return copy(created)
+
+    def getNote(self, guid, with_content, with_resources_data, with_recognition, with_alternate):
+        note = copy(self.get_note(guid))
+        if with_content:
+            note.content = self.contents[guid]
+        return note
+
+    def getNoteContent(self, guid):
+        self.get_note(guid)
+        return self.contents[guid]
+
+    def updateNote(self, note):
+        stored = self.get_note(note.guid)
+        with self._lock:
+            self.uploaded += len(note.content or '')
+        if note.title:
+            stored.title = note.title
+        if note.content is not None:
+            self.contents[note.guid] = note.content
+        stored.updateSequenceNum = next(self._usn)
+        return copy(stored)
+
+    def getSyncState(self):
+        return SyncState(currentTime=int(time.time() * 1000), updateCount=next(self._usn), uploaded=self.uploaded)
+
+    def getUser(self):
+        accounting = Types.Accounting(uploadLimit=self.upload_limit, uploadLimitEnd=4102444800000)  # 2100-01-01
+        return Types.User(id=1, username='fake', shardId='s1', accounting=accounting)
+
+
+class FakeStore:
+    def __init__(self, evernote: FakeEvernote, token: str, methods: dict):
+        self._evernote = evernote
+        self._token = token
+        self._methods = methods
+
+    def __getattr__(self, name):
+        method = self._methods.get(name)
+        if method is None:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self._evernote.before_call(self._token, name)
+            return method(*args, **kwargs)
+
+        return call
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    '''
+    Telegram Bot API server answering every method the bot uses.
+    Files are generated from their file_id, `file_size` bytes each.
+    Updates added by `add_updates()` are returned by `getUpdates`.
+    '''
+
+    def __init__(self, file_size: int = 64 * 1024):
+        self.file_size = file_size
+        self.calls = Counter()
+        self.downloads = 0
+        self.error_messages = 0
+        self.port = None
+        self.updates = []
+        self.offset = 0
+        self._new_updates = asyncio.Event()
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.api_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.file)
+        self._runner = web.AppRunner(app, access_log=None)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/'
+
+    async def start(self) -> None:
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    def add_updates(self, updates: list) -> None:
+        self.updates.extend(updates)
+        self._new_updates.set()
+
+    async def get_updates(self, params: dict) -> list:
+        if params.get('offset'):
+            self.offset = max(self.offset, params['offset'])
+            self.updates = [u for u in self.updates if u['update_id'] >= self.offset]
+        if not self.updates and params.get('timeout'):
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), params['timeout'])
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:params.get('limit', 100)]
+
+    async def api_method(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            result = await self.get_updates(await request.json())
+        elif method == 'getFile':
+            params = await request.json()
+            result = {'file_path': f'files/{params["file_id"]}.jpg'}
+        elif method == 'sendMessage':
+            params = await request.json()
+            if params['text'].startswith('\u274c'):
+                self.error_messages += 1
+            result = {'message_id': self.calls[method]}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def file(self, request):
+        self.downloads += 1
+        seed = hashlib.sha256(request.match_info['path'].encode()).digest()
+        data = seed * (self.file_size // len(seed) + 1)
+        return web.Response(body=data[:self.file_size])
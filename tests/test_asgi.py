@@ -0,0 +1,98 @@
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.util.asgi import AsgiApplication, Router
+
+
+async def echo(request):
+    return await request.read() if request.body is None else request.body
+
+
+class TestAsgiApplication(IsolatedAsyncioTestCase):
+    async def request(self, app, method, path, body=b'', chunk_size=None, headers=()):
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': list(headers)}
+        chunk_size = chunk_size or len(body) or 1
+        messages = [
+            {'type': 'http.request', 'body': body[i:i + chunk_size], 'more_body': i + chunk_size < len(body)}
+            for i in range(0, len(body) or 1, chunk_size)
+        ]
+        self.messages = messages
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        return sent
+
+    async def test_access_log(self):
+        token = '123:token-x'
+        app = AsgiApplication((('POST', rf'^/{token}$', echo),))
+        with self.assertLogs('wsgi', level='INFO') as logs:
+            sent = await self.request(app, 'POST', f'/{token}', b'x' * 10000)
+            await self.request(app, 'GET', f'/unknown/{token}')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertEqual(len(logs.records), 2)
+        self.assertRegex(logs.records[0].getMessage(), r'^POST echo 200 [\d.]+ms 10000/10000 bytes$')
+        self.assertRegex(logs.records[1].getMessage(), r'^GET not_found 404 ')
+        self.assertFalse(any(token in record.getMessage() for record in logs.records))
+        with self.assertLogs('wsgi', level='DEBUG') as logs:
+            await self.request(app, 'POST', f'/{token}', b'x' * 10000)
+        self.assertLess(len(logs.records[1].getMessage()), 2 * 1024 + 100)
+
+    async def test_body(self):
+        app = AsgiApplication((('POST', r'^/echo$', echo),), max_body_size=1000)
+        sent = await self.request(app, 'POST', '/echo', b'x' * 1000, chunk_size=100)
+        self.assertEqual(sent[1]['body'], b'x' * 1000)
+        sent = await self.request(app, 'POST', '/echo', b'x' * 1001, chunk_size=100)
+        self.assertEqual(sent[0]['status'], 413)
+        self.assertEqual(len(self.messages), 0)  # the last chunk is left unread
+        await self.request(app, 'POST', '/unknown', b'x' * 1000, chunk_size=100)
+        self.assertEqual(len(self.messages), 10)  # the body isn't read if nobody needs it
+        for content_length in (b'abc', b'-1'):
+            sent = await self.request(app, 'POST', '/echo', b'x' * 10, headers=[(b'content-length', content_length)])
+            self.assertEqual(sent[0]['status'], 400)
+            self.assertEqual(len(self.messages), 1)
+        sent = await self.request(app, 'POST', '/echo', b'x' * 10, headers=[(b'content-length', b'10')])
+        self.assertEqual(sent[1]['body'], b'x' * 10)
+
+    async def test_lifespan(self):
+        events = []
+
+        class App(AsgiApplication):
+            async def on_startup(self):
+                events.append('startup')
+
+            async def on_shutdown(self):
+                events.append('shutdown')
+
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await App(())({'type': 'lifespan'}, receive, send)
+        self.assertEqual(events, ['startup', 'shutdown'])
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+
+
+class TestRouter(IsolatedAsyncioTestCase):
+    def test_match(self):
+        router = Router((
+            ('POST', r'^/123:token-x/set$', 'set_webhook'),
+            ('POST', r'^/123:token-x$', 'telegram_hook'),
+            ('GET', r'^/user/(\d+)$', 'user'),
+            ('GET', r'^/user/(\d+)/notes/(\w+)$', 'note'),
+        ))
+        self.assertEqual(router.match('/123:token-x', 'POST'), ('telegram_hook', ()))
+        self.assertEqual(router.match('/123:token-x/set', 'POST'), ('set_webhook', ()))
+        self.assertIsNone(router.match('/123:token-x', 'GET'))
+        self.assertEqual(router.match('/user/1', 'GET'), ('user', ('1',)))
+        self.assertEqual(router.match('/user/1/notes/abc', 'GET'), ('note', ('1', 'abc')))
+        self.assertIsNone(router.match('/user/x', 'GET'))
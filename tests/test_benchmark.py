@@ -0,0 +1,29 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from tests.benchmark import main
+
+
+class TestBenchmark(TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'benchmark.json')
+            report = main(['--updates', '200', '--users', '20', '--concurrency', '10', '--output', output])
+            self.assertTrue(os.path.exists(output))
+        results = report['results']
+        self.assertEqual(results['queue']['processed'], 200)
+        self.assertEqual(results['failed'], 0)
+        self.assertEqual(results['error_messages'], 0)
+        self.assertLess(results['downloads'], results['bot_api_calls']['sendMessage'])
+
+    def test_evernote_errors(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'benchmark.json')
+            report = main(['--updates', '100', '--users', '10', '--concurrency', '10',
+                           '--evernote-error-rate', '0.2', '--timeout', '30', '--output', output])
+        results = report['results']
+        self.assertTrue(results['evernote_errors'])
+        self.assertEqual(results['queue']['processed'] + results['queue']['failed'], 100)
+        self.assertEqual(results['queue']['failed'], 0)  # failures are reported, not raised
+        self.assertGreater(results['failed'] + results['error_messages'], 0)
@@ -0,0 +1,52 @@
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot import EvernoteBot
+from evernotebot.bot.errors import EvernoteBotException
+from evernotebot.config import load_config
+
+
+class TestProcessUpdate(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        config = load_config()
+        config['processes'] = 1
+        config['storage'] = {
+            'provider': 'evernotebot.storage.providers.sqlite.AsyncSqlite',
+            'dirpath': self.tmp_dir.name,
+            'db_name': 'bot',
+        }
+        self.bot = EvernoteBot(config)
+
+    async def asyncTearDown(self) -> None:
+        await self.bot.exec_all_mixins('on_bot_stop')
+        await self.bot.failed_updates.close()
+        self.tmp_dir.cleanup()
+
+    async def test_reporting_failures(self):
+        async def fail(*args, **kwargs):
+            raise Exception('Reporting failed')
+
+        async def receive_message(message):
+            raise EvernoteBotException('Quota exceeded')
+
+        update = {
+            'update_id': 1,
+            'message': {'message_id': 1, 'from': {'id': 1}, 'chat': {'id': 1}, 'text': 'text'},
+        }
+        self.bot.send_message = fail
+        self.bot.receive_message = receive_message
+        with self.assertLogs('evernotebot', 'ERROR') as logs:
+            await self.bot.process_update(update)
+        self.assertIn('Failed to report an error to the user', logs.output[-1])
+
+        async def receive_message(message):
+            raise ValueError('Bug')
+
+        self.bot.receive_message = receive_message
+        await self.bot.process_update(update)
+        self.assertEqual(len(await self.bot.failed_updates.get_all()), 1)
+        self.bot.failed_updates.create = fail
+        with self.assertLogs('evernotebot', 'ERROR') as logs:
+            await self.bot.process_update(update)
+        self.assertIn('Failed to save a failed update', logs.output[-1])
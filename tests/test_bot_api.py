@@ -0,0 +1,57 @@
+import hashlib
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from aiohttp import web
+
+from evernotebot.bot.api import BotApi, FileTooBigError
+
+
+class TestBotApi(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.file_data = os.urandom(300 * 1024)
+
+        async def api_method(request):
+            return web.json_response({'ok': True, 'result': {'message_id': 1}})
+
+        async def file(request):
+            return web.Response(body=self.file_data)
+
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', api_method)
+        app.router.add_get('/file/bot{token}/{path}', file)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.api = BotApi('token', f'http://127.0.0.1:{port}/', download_chunk_size=64 * 1024)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self) -> None:
+        await self.api.close()
+        await self.runner.cleanup()
+        self.tmp_dir.cleanup()
+
+    async def test_connection_reuse(self):
+        for _ in range(3):
+            await self.api.sendMessage(1, 'text')
+        self.assertEqual(self.api.pool_stats['connections_created'], 1)
+        self.assertEqual(self.api.pool_stats['connections_reused'], 2)
+
+    async def test_download_file(self):
+        url = f'{self.api.api_url}/file/bottoken/photo.jpg'
+        filepath = os.path.join(self.tmp_dir.name, 'photo.jpg')
+        info = await self.api.download_file(url, filepath)
+        self.assertEqual(info['size'], len(self.file_data))
+        self.assertEqual(info['md5'], hashlib.md5(self.file_data).hexdigest())
+        with open(filepath, 'rb') as f:
+            self.assertEqual(f.read(), self.file_data)
+
+    async def test_download_file_too_big(self):
+        url = f'{self.api.api_url}/file/bottoken/photo.jpg'
+        filepath = os.path.join(self.tmp_dir.name, 'photo.jpg')
+        with self.assertRaises(FileTooBigError):
+            await self.api.download_file(url, filepath, max_size=100 * 1024)
+        self.assertFalse(os.path.exists(filepath))
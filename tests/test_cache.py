@@ -0,0 +1,29 @@
+from unittest import TestCase, mock
+
+from evernotebot.util.cache import LruCache
+
+
+class TestLruCache(TestCase):
+    def test_max_size(self):
+        evicted = []
+        cache = LruCache(max_size=2, on_evict=lambda key, value: evicted.append(key))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # `b` is least recently used now
+        cache.set('c', 3)
+        self.assertEqual(evicted, ['b'])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats, {'size': 2, 'max_size': 2, 'hits': 1, 'misses': 1})
+
+    def test_ttl(self):
+        with mock.patch('evernotebot.util.cache.monotonic') as monotonic:
+            monotonic.return_value = 100
+            cache = LruCache(ttl=10)
+            cache.set('a', 1)
+            cache.set('b', 2)
+            monotonic.return_value = 105
+            self.assertEqual(cache.get('a'), 1)
+            monotonic.return_value = 112
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('a'), 1)
+            self.assertEqual(len(cache), 1)
@@ -0,0 +1,115 @@
+import hashlib
+import io
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+
+from evernotebot.util.evernote.client import BufferBinaryProtocol, EvernoteApi, NoteContent
+
+
+def make_user():
+    accounting = SimpleNamespace(uploadLimit=1000, uploadLimitEnd=4102444800000)  # 2100-01-01
+    return SimpleNamespace(id=1, shardId='s1', accounting=accounting)
+
+
+class TestEvernoteApi(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.api = EvernoteApi('token', sandbox=True)
+        self.user_store = mock.Mock()
+        self.user_store.getUser = mock.Mock(return_value=make_user())
+        self.note_store = mock.Mock()
+        self.note_store.getSyncState = mock.Mock(return_value=SimpleNamespace(uploaded=100))
+        self.api._user_store = self.user_store
+        self.api._notes_store = self.note_store
+
+    async def asyncTearDown(self) -> None:
+        await self.api.executor.shutdown()
+
+    async def test_note_link(self):
+        link = await self.api.get_note_link('guid')
+        self.assertEqual(link, 'https://sandbox.evernote.com/shard/s1/nl/1/guid/')
+        await self.api.get_note_link('guid2')
+        self.assertEqual(self.user_store.getUser.call_count, 1)
+
+    async def test_quota(self):
+        quota = await self.api.get_quota_info()
+        self.assertEqual(quota['remaining'], 900)
+        self.api.track_upload(200)
+        quota = await self.api.get_quota_info()
+        self.assertEqual(quota['remaining'], 700)
+        self.assertEqual(self.note_store.getSyncState.call_count, 1)
+        self.assertEqual(self.user_store.getUser.call_count, 1)
+        self.api.quota_ttl = 0
+        quota = await self.api.get_quota_info()
+        self.assertEqual(quota['remaining'], 900)
+        self.assertEqual(self.note_store.getSyncState.call_count, 2)
+
+    async def test_update_note(self):
+        note = SimpleNamespace(guid='guid', title='Title', notebookGuid='nb', updateSequenceNum=10)
+        self.note_store.getNote = mock.Mock(return_value=note)
+        self.note_store.getNoteContent = mock.Mock(return_value='<?xml?><en-note style="x">old<br />\nline</en-note>')
+        self.note_store.updateNote = mock.Mock(side_effect=lambda n: SimpleNamespace(updateSequenceNum=11))
+        await self.api.update_note('guid', text='first')
+        self.note_store.getNote.assert_called_with('guid', False, False, False, False)
+        updated = self.note_store.updateNote.call_args[0][0]
+        self.assertIn('<en-note>old<br />\nline<br /><div>first</div></en-note>', updated.content)
+        self.assertIsNone(updated.resources)
+        note.updateSequenceNum = 11
+        await self.api.update_note('guid', text='second')
+        self.assertEqual(self.note_store.getNoteContent.call_count, 1)
+        updated = self.note_store.updateNote.call_args[0][0]
+        self.assertIn('<div>first</div><br /><div>second</div></en-note>', updated.content)
+
+    async def test_upload_bytes(self):
+        note = SimpleNamespace(guid='guid', title='Title', notebookGuid='nb', updateSequenceNum=10)
+        self.note_store.getNote = mock.Mock(return_value=note)
+        self.note_store.getNoteContent = mock.Mock(return_value='<?xml?><en-note></en-note>')
+        self.note_store.updateNote = mock.Mock(side_effect=lambda n: SimpleNamespace(updateSequenceNum=11))
+        await self.api.get_quota_info()
+        await self.api.update_note('guid', text='привет')
+        updated = self.note_store.updateNote.call_args[0][0]
+        self.assertEqual(self.api._uploaded, 100 + len(updated.content.encode()))
+        self.assertGreater(len(updated.content.encode()), len(updated.content))
+
+    async def test_notebooks_cache(self):
+        notebooks = [SimpleNamespace(guid='1', name='Default'), SimpleNamespace(guid='2', name='Work')]
+        self.note_store.listNotebooks = mock.Mock(return_value=notebooks)
+        self.assertEqual(len(await self.api.get_all_notebooks()), 2)
+        self.assertEqual(await self.api.get_all_notebooks({'name': 'Work'}), [{'guid': '2', 'name': 'Work'}])
+        self.assertEqual(await self.api.get_all_notebooks({'guid': '1'}), [{'guid': '1', 'name': 'Default'}])
+        self.assertEqual(await self.api.get_all_notebooks({'name': 'Unknown'}), [])
+        self.assertEqual(self.note_store.listNotebooks.call_count, 1)
+        self.api.invalidate_notebooks()
+        await self.api.get_all_notebooks()
+        self.assertEqual(self.note_store.listNotebooks.call_count, 2)
+
+        # A list stored in the user document is used by a new client
+        api = EvernoteApi('token', sandbox=True, executor=self.api.executor)
+        api._notes_store = self.note_store
+        api.load_notebooks(self.api.notebooks)
+        self.assertEqual(len(await api.get_all_notebooks()), 2)
+        self.assertEqual(self.note_store.listNotebooks.call_count, 2)
+
+
+class TestNoteResources(TestCase):
+    def test_mapped_resource(self):
+        data = os.urandom(100 * 1024)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            file_info = {'path': f.name, 'name': 'photo.jpg', 'md5': hashlib.md5(data).hexdigest()}
+            with NoteContent() as content:
+                content.append(file=file_info)
+                resource = content.resources[0]
+                self.assertEqual(resource.data.size, len(data))
+                self.assertEqual(resource.mime, 'image/jpeg')
+                mapped = io.BytesIO()
+                resource.write(BufferBinaryProtocol(mapped))
+            self.assertTrue(resource.data.body.closed)
+        resource.data.body = data
+        expected = io.BytesIO()
+        resource.write(TBinaryProtocol(expected))
+        self.assertEqual(mapped.getvalue(), expected.getvalue())
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.util.evernote.executor import SdkExecutor
+
+
+class TestSdkExecutor(IsolatedAsyncioTestCase):
+    async def test_per_user_limit(self):
+        executor = SdkExecutor(max_workers=4)
+        lock = threading.Lock()
+        running = {'max': 0, 'now': 0}
+
+        def call():
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            return threading.current_thread().name
+
+        names = await asyncio.gather(*(executor.run('user', call) for _ in range(5)))
+        self.assertEqual(running['max'], 1)
+        self.assertTrue(all(name.startswith('evernote') for name in names))
+        stats = executor.stats
+        self.assertEqual(stats['calls'], 5)
+        self.assertEqual(stats['waiting_for_user'], 0)
+        self.assertGreater(stats['max_wait_time'], 0)
+        running['max'] = 0
+        await asyncio.gather(*(executor.run(f'user{i}', call) for i in range(4)))
+        self.assertGreater(running['max'], 1)  # different users aren't serialized
+        await executor.shutdown()
+
+    async def test_errors_and_shutdown(self):
+        executor = SdkExecutor(max_workers=2)
+
+        def fail():
+            raise ValueError('error')
+
+        with self.assertRaises(ValueError):
+            await executor.run('user', fail)
+        self.assertEqual(executor.stats['errors'], 1)
+        await executor.shutdown()
+        with self.assertRaises(Exception):
+            await executor.run('user', lambda: 1)
+
+    async def test_queued(self):
+        executor = SdkExecutor(max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def call():
+            started.set()
+            release.wait(5)
+
+        calls = [asyncio.create_task(executor.run(f'user{i}', call)) for i in range(3)]
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        stats = executor.stats
+        self.assertEqual((stats['running'], stats['queued'], stats['waiting_for_user']), (1, 2, 0))
+        release.set()
+        await asyncio.gather(*calls)
+        stats = executor.stats
+        self.assertEqual((stats['running'], stats['queued']), (0, 0))
+        await executor.shutdown()
@@ -0,0 +1,50 @@
+from time import perf_counter
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.util.evernote.client import EvernoteApi, EvernoteApiError
+from tests.evernote.store import FakeEvernote
+
+
+class TestFakeEvernote(IsolatedAsyncioTestCase):
+    def make_api(self, evernote: FakeEvernote, token: str = 'token') -> EvernoteApi:
+        api = EvernoteApi(token, sandbox=True)
+        evernote.install(api)
+        return api
+
+    async def asyncTearDown(self) -> None:
+        for api in getattr(self, 'apis', ()):
+            await api.executor.shutdown()
+
+    async def test_notes(self):
+        evernote = FakeEvernote()
+        api = self.make_api(evernote)
+        self.apis = [api]
+        notebook = await api.get_default_notebook()
+        note_id = await api.create_note(notebook['guid'], text='first', title='Title')
+        await api.update_note(note_id, text='second')
+        self.assertIn('<div>first</div><br /><div>second</div>', evernote.contents[note_id])
+        quota = await api.get_quota_info()
+        self.assertEqual(quota['remaining'], evernote.upload_limit - evernote.uploaded)
+        self.assertEqual(evernote.calls['createNote'], 1)
+        self.assertEqual(evernote.calls['updateNote'], 1)
+
+    async def test_latency_and_errors(self):
+        evernote = FakeEvernote(latency=0.02, error_rate=1.0)
+        api = self.make_api(evernote)
+        self.apis = [api]
+        started = perf_counter()
+        with self.assertRaises(EvernoteApiError):
+            await api.get_all_notebooks()
+        self.assertGreaterEqual(perf_counter() - started, 0.02)
+        self.assertEqual(evernote.errors['INTERNAL_ERROR'], 1)
+
+    async def test_rate_limit(self):
+        evernote = FakeEvernote(rate_limit=(2, 60))
+        api, other_api = self.make_api(evernote), self.make_api(evernote, 'other_token')
+        self.apis = [api, other_api]
+        await api.get_default_notebook()
+        await api.get_default_notebook()
+        with self.assertRaisesRegex(EvernoteApiError, 'Rate limit reached'):
+            await api.get_default_notebook()
+        await other_api.get_default_notebook()  # the limit is per user
+        self.assertEqual(evernote.errors['RATE_LIMIT_REACHED'], 1)
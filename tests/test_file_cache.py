@@ -0,0 +1,43 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from evernotebot.util.file_cache import FileCache
+
+
+class TestFileCache(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = FileCache(os.path.join(self.tmp_dir.name, 'files'), max_size=250)
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def download(self, name, size):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(name.encode()[:1] * size)
+        return {'path': path, 'name': name, 'size': size, 'md5': 'md5', 'mime_type': 'image/jpeg'}
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('a', os.path.join(self.tmp_dir.name, 'copy')))
+        file_info = self.download('a.jpg', 100)
+        self.cache.put('a', file_info)
+        os.unlink(file_info['path'])  # the update is processed, its files are removed
+        path = os.path.join(self.tmp_dir.name, 'copy')
+        cached = self.cache.get('a', path)
+        self.assertEqual(cached, dict(file_info, path=path))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 100)
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_eviction(self):
+        self.cache.put('a', self.download('a', 100))
+        self.cache.put('b', self.download('b', 100))
+        self.cache.get('a', os.path.join(self.tmp_dir.name, 'a_copy'))  # `b` is least recently used now
+        self.cache.put('c', self.download('c', 100))
+        self.cache.put('big', self.download('big', 300))
+        self.assertEqual(self.cache.stats['size'], 200)
+        self.assertEqual(sorted(os.listdir(self.cache.root)), ['a', 'c'])
+        self.assertIsNone(self.cache.get('b', os.path.join(self.tmp_dir.name, 'b_copy')))
@@ -0,0 +1,80 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from evernotebot.util.asgi import AsgiApplication
+from evernotebot.util.metrics import Registry, add_labels, render, stats_families
+
+
+class TestMetrics(TestCase):
+    def test_render(self):
+        registry = Registry()
+        requests = registry.counter('requests_total', 'Requests', labels=('method',))
+        requests.inc(method='get')
+        requests.inc(2, method='say "hi"')
+        duration = registry.histogram('duration_seconds', 'Duration', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5):
+            duration.observe(value)
+        self.assertIs(registry.counter('requests_total', 'Requests', labels=('method',)), requests)
+        with self.assertRaises(ValueError):
+            requests.inc(path='/')
+        self.assertEqual(render(registry.collect()).splitlines(), [
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{method="get"} 1',
+            'requests_total{method="say \\"hi\\""} 2',
+            '# HELP duration_seconds Duration',
+            '# TYPE duration_seconds histogram',
+            'duration_seconds_bucket{le="0.1"} 1',
+            'duration_seconds_bucket{le="1"} 3',
+            'duration_seconds_bucket{le="+Inf"} 4',
+            'duration_seconds_sum 6.05',
+            'duration_seconds_count 4',
+        ])
+
+    def test_stats(self):
+        stats = {
+            'queue': {'depth': 3, 'running': True},
+            'workers': [{'index': 0, 'pending': 1}, {'index': 1, 'pending': 2}],
+            'offset': None,
+        }
+        families = stats_families('bot', stats)
+        families += add_labels(stats_families('bot', {'queue': {'depth': 1}}), worker=1)
+        self.assertEqual(render(families).splitlines(), [
+            '# TYPE bot_queue_depth gauge',
+            'bot_queue_depth 3',
+            'bot_queue_depth{worker="1"} 1',
+            '# TYPE bot_queue_running gauge',
+            'bot_queue_running 1',
+            '# TYPE bot_workers_pending gauge',
+            'bot_workers_pending{index="0"} 1',
+            'bot_workers_pending{index="1"} 2',
+        ])
+
+
+class TestMetricsEndpoint(IsolatedAsyncioTestCase):
+    async def request(self, app, method, path):
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b''}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app(scope, receive, send)
+        return sent
+
+    async def test_metrics(self):
+        async def hello(request):
+            return 'hello'
+
+        app = AsgiApplication((('GET', r'^/hello$', hello),), metrics_path='/metrics')
+        await self.request(app, 'GET', '/hello')
+        sent = await self.request(app, 'GET', '/metrics')
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/plain; version=0.0.4; charset=utf-8'), sent[0]['headers'])
+        body = sent[1]['body'].decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'http_request_duration_seconds_count\{handler="hello",status="200"\} \d+')
+        sent = await self.request(AsgiApplication(()), 'GET', '/metrics')  # disabled by default
+        self.assertEqual(sent[0]['status'], 404)
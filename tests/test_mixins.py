@@ -0,0 +1,49 @@
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.bot.mixins.base import BaseMixin
+
+
+class A(BaseMixin):
+    async def on_update(self, calls):
+        calls.append('A')
+
+
+class B(A):
+    async def on_update(self, calls):
+        await super().on_update(calls)
+        calls.append('B')
+
+
+class StartCommand(B):
+    command = 'start'
+
+    async def on_command(self, name):
+        self.commands.append(name)
+
+
+class HelpCommand(A):
+    command = 'help'
+
+    async def on_command(self, name):
+        self.commands.append(name)
+
+
+class Bot(StartCommand, HelpCommand):
+    def __init__(self):
+        super().__init__({'telegram': {'bot_name': 'bot'}})
+        self.commands = []
+
+
+class TestMixinCallbacks(IsolatedAsyncioTestCase):
+    async def test_callbacks(self):
+        bot = Bot()
+        calls = []
+        await bot.exec_all_mixins('on_update', calls)
+        self.assertEqual(calls, ['A', 'B'])  # `A.on_update` is called by `B` only
+
+    async def test_commands(self):
+        bot = Bot()
+        await bot.exec_command('help')
+        await bot.exec_command('unknown')
+        await bot.exec_command('start')
+        self.assertEqual(bot.commands, ['help', 'start'])
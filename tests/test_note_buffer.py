@@ -0,0 +1,97 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.util.evernote.buffer import NoteAppendBuffer
+
+
+class FakeEvernoteApi:
+    def __init__(self, fail=False, fail_calls=0):
+        self.fail = fail
+        self.fail_calls = fail_calls  # number of first calls to fail
+        self.calls = []
+
+    async def append_to_note(self, note_id, fragments):
+        await asyncio.sleep(0.01)
+        if self.fail or self.fail_calls > 0:
+            self.fail_calls -= 1
+            raise Exception('Evernote is down')
+        self.calls.append((note_id, [f['text'] for f in fragments]))
+
+
+class TestNoteAppendBuffer(IsolatedAsyncioTestCase):
+    async def test_coalesce(self):
+        api = FakeEvernoteApi()
+        buffer = NoteAppendBuffer(delay=0.05, max_fragments=3)
+        for text in ('1', '2', '3', '4'):
+            await buffer.append(api, 'note', {'text': text})
+        self.assertEqual(api.calls, [])  # nothing is written until the flush task runs
+        await asyncio.sleep(0.02)
+        self.assertEqual(api.calls, [('note', ['1', '2', '3'])])
+        await buffer.append(api, 'note', {'text': '5', 'files': ({'path': '/tmp/file'},)})
+        self.assertEqual(api.calls, [('note', ['1', '2', '3']), ('note', ['4']), ('note', ['5'])])
+
+    async def test_flush_on_close(self):
+        api = FakeEvernoteApi()
+        buffer = NoteAppendBuffer(delay=60)
+        await buffer.append(api, 'note1', {'text': '1'})
+        await buffer.append(api, 'note2', {'text': '2'})
+        await buffer.close()
+        self.assertEqual(sorted(api.calls), [('note1', ['1']), ('note2', ['2'])])
+
+    async def test_error(self):
+        errors = []
+
+        async def on_error(e):
+            errors.append(str(e))
+
+        buffer = NoteAppendBuffer(delay=0.01)
+        await buffer.append(FakeEvernoteApi(fail=True), 'note', {'text': '1'}, on_error=on_error)
+        await buffer.append(FakeEvernoteApi(fail=True), 'note', {'text': '2'}, on_error=on_error)
+        await buffer.close()
+        self.assertEqual(errors, ['Evernote is down', 'Evernote is down'])
+
+    async def test_error_of_owner(self):
+        errors = []
+
+        def on_error(name):
+            async def handler(e):
+                errors.append(name)
+            return handler
+
+        api = FakeEvernoteApi(fail_calls=1)
+        buffer = NoteAppendBuffer(delay=0.01)
+        on_error_a, on_error_b = on_error('a'), on_error('b')
+        await buffer.append(api, 'note', {'text': '1'}, on_error=on_error_a)
+        await buffer.append(api, 'note', {'text': '2'}, on_error=on_error_b)
+        await buffer.append(api, 'note', {'text': '3'}, on_error=on_error_a)
+        # Written right after the failed batch, it must not get its error
+        await buffer.append(api, 'note', {'text': '4', 'files': ({'path': '/tmp/file'},)}, on_error=on_error('c'))
+        await buffer.append(api, 'note', {'text': '5', 'files': ({'path': '/tmp/file'},)})
+        await buffer.append(api, 'note', {'text': '6'}, on_error=on_error('d'))
+        await buffer.close()
+        self.assertEqual(errors, ['a', 'b'])
+        self.assertEqual(api.calls, [('note', ['4']), ('note', ['5']), ('note', ['6'])])
+
+    async def test_saved_after_flush(self):
+        messages = []
+
+        def handlers(name):
+            async def on_error(e):
+                messages.append(f'{name}: error')
+
+            async def on_saved():
+                messages.append(f'{name}: saved')
+            return {'on_error': on_error, 'on_saved': on_saved}
+
+        api = FakeEvernoteApi(fail_calls=1)
+        buffer = NoteAppendBuffer(delay=0.01)
+        await buffer.append(api, 'note', {'text': '1'}, **handlers('a'))
+        self.assertEqual(messages, [])  # only buffered, nothing is saved yet
+        await buffer.append(api, 'note', {'text': '2', 'files': ({'path': '/tmp/file'},)}, **handlers('b'))
+        await buffer.append(api, 'note', {'text': '3'}, **handlers('c'))
+        await buffer.close()
+        self.assertEqual(messages, ['a: error', 'b: saved', 'c: saved'])
+        messages.clear()
+        api.fail_calls = 1
+        await buffer.append(api, 'note', {'text': '4', 'files': ({'path': '/tmp/file'},)}, **handlers('d'))
+        self.assertEqual(messages, ['d: error'])
@@ -0,0 +1,80 @@
+import asyncio
+from time import time
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.bot.api import BotApi
+from evernotebot.bot.polling import UpdatePoller
+from tests.telegram.fake_bot_api import FakeBotApi
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}, 'date': int(time()) - 60}}
+
+
+class TestUpdatePoller(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.bot_api = FakeBotApi()
+        await self.bot_api.start()
+        self.api = BotApi('token', self.bot_api.url)
+
+    async def asyncTearDown(self) -> None:
+        await self.api.close()
+        await self.bot_api.stop()
+
+    async def test_batches(self):
+        processed = []
+        running = set()
+        max_running = 0
+        done = asyncio.Event()
+
+        async def handler(update):
+            nonlocal max_running
+            chat_id = update['message']['chat']['id']
+            self.assertNotIn(chat_id, running)
+            running.add(chat_id)
+            max_running = max(max_running, len(running))
+            await asyncio.sleep(0.001 * (update['update_id'] % 3))
+            running.discard(chat_id)
+            processed.append(update['update_id'])
+            if len(processed) == 250:
+                done.set()
+
+        self.bot_api.add_updates([make_update(update_id, update_id % 10) for update_id in range(1, 251)])
+        poller = UpdatePoller(self.api, handler, timeout=1, concurrency=4)
+        await poller.start()
+        await asyncio.wait_for(done.wait(), 5)
+        await poller.stop()
+        self.assertEqual(sorted(processed), list(range(1, 251)))
+        for chat_id in range(10):
+            chat_updates = [x for x in processed if x % 10 == chat_id]
+            self.assertEqual(chat_updates, sorted(chat_updates))
+        self.assertEqual(max_running, 4)
+        self.assertEqual(self.bot_api.calls['deleteWebhook'], 1)
+        self.assertEqual(self.bot_api.updates, [])  # confirmed on stop
+        stats = poller.stats
+        self.assertEqual(stats['offset'], 251)
+        self.assertEqual(stats['batches'], 3)
+        self.assertEqual(stats['processed'], 250)
+        self.assertGreaterEqual(stats['lag'], 60)
+
+    async def test_offset_after_processing(self):
+        event = asyncio.Event()
+        started = asyncio.Event()
+
+        async def handler(update):
+            started.set()
+            if update['update_id'] == 2:
+                raise Exception('failed')
+            await event.wait()
+
+        self.bot_api.add_updates([make_update(1, 1), make_update(2, 2)])
+        poller = UpdatePoller(self.api, handler, timeout=1)
+        await poller.start()
+        await started.wait()
+        self.assertIsNone(poller.offset)
+        self.assertEqual(len(self.bot_api.updates), 2)
+        event.set()
+        await poller.stop()
+        self.assertEqual(poller.offset, 3)
+        self.assertEqual(poller.stats['failed'], 1)
+        self.assertEqual(self.bot_api.updates, [])
@@ -1,8 +1,11 @@
+import asyncio
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from unittest import TestCase
+from unittest import IsolatedAsyncioTestCase, TestCase, skipUnless
 
-from evernotebot.storage import Storage
+from evernotebot.storage import AsyncStorage, Storage
 
 
 class TestStorage(TestCase):
@@ -43,3 +46,126 @@ class TestStorage(TestCase):
         self.assertEqual(object_data, {'id': 2, 'x': 123, 'z': 'xxx'})
         storage.close()
         self.assertRaises(Exception, lambda: storage.get(2))
+
+    def test_query(self):
+        storage = Storage('test', self.config, indexes=('evernote.oauth.callback_key',))
+        storage.create({'id': 1, 'evernote': {'oauth': {'callback_key': 'a'}}, 'active': True})
+        storage.create({'id': 2, 'evernote': {'oauth': {'callback_key': 'b'}}, 'active': False})
+        storage.create({'id': 3, 'evernote': {}})
+        found = list(storage.get_all({'evernote.oauth.callback_key': 'b'}))
+        self.assertEqual([x['id'] for x in found], [2])
+        found = list(storage.get_all({'evernote': {'oauth': {'callback_key': 'a'}}}))
+        self.assertEqual([x['id'] for x in found], [1])
+        found = list(storage.get_all({'active': True}))
+        self.assertEqual([x['id'] for x in found], [1])
+        found = list(storage.get_all({'evernote.oauth.callback_key': None}))
+        self.assertEqual([x['id'] for x in found], [3])
+        self.assertEqual(storage.get({'id': 2, 'active': False})['id'], 2)
+        self.assertRaises(Exception, lambda: list(storage.get_all({'a\'; DROP TABLE test; --': 1})))
+        plan = storage.provider.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM test WHERE json_extract(data, '$.evernote.oauth.callback_key')='a'"
+        ).fetchall()
+        self.assertIn('test_evernote_oauth_callback_key_idx', str(plan))
+        storage.close()
+
+    def test_create_indexes_twice(self):
+        # Every worker process creates the tables and indexes with its own connection
+        storages = [Storage('test', self.config, indexes=('evernote.oauth.callback_key',)) for _ in range(2)]
+        self.assertIsNot(storages[0].provider.connection, storages[1].provider.connection)
+        storages[0].create({'id': 1, 'evernote': {'oauth': {'callback_key': 'a'}}})
+        self.assertEqual(storages[1].get({'evernote.oauth.callback_key': 'a'})['id'], 1)
+        for storage in storages:
+            storage.close()
+
+
+@skipUnless(os.getenv('DATABASE_URL'), 'PostgreSQL is not configured')
+class TestPostgreSQL(IsolatedAsyncioTestCase):
+    indexes = ('evernote.oauth.callback_key', 'chat_id')
+
+    def setUp(self) -> None:
+        self.config = {'provider': 'evernotebot.storage.providers.postgres.PostgreSQL', 'db_name': 'test'}
+        self.drop()
+
+    def tearDown(self) -> None:
+        self.drop()
+
+    def drop(self):
+        storage = Storage('test_schema', self.config)
+        with storage.provider._pool.connection() as connection, connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS test_schema')
+        storage.close()
+
+    def test_create_indexes_twice(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:  # a connection per thread
+            storages = list(executor.map(lambda _: Storage('test_schema', self.config, indexes=self.indexes),
+                                         range(4)))
+        for storage in storages:
+            storage.close()
+
+    async def test_async_create_indexes_twice(self):
+        config = dict(self.config, provider='evernotebot.storage.providers.postgres.AsyncPostgreSQL')
+        storages = [AsyncStorage('test_schema', config, indexes=self.indexes) for _ in range(4)]
+        results = await asyncio.gather(*(storage.get_all() for storage in storages))
+        self.assertEqual(results, [[]] * 4)
+        for storage in storages:
+            await storage.close()
+
+
+class TestAsyncStorage(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.config = {
+            'provider': 'evernotebot.storage.providers.sqlite.AsyncSqlite',
+            'dirpath': '/tmp',  # nosec
+            'db_name': 'test_async',
+        }
+        self.clear()
+
+    def tearDown(self) -> None:
+        self.clear()
+
+    def clear(self):
+        filepath = Path(self.config['dirpath'], f'{self.config["db_name"]}.sqlite')
+        if filepath.exists():
+            os.unlink(filepath.resolve())
+
+    async def test_base(self):
+        storage = AsyncStorage('test', self.config)
+        object_id = await storage.create({'id': 2, 'x': 123})
+        self.assertEqual(object_id, 2)
+        data = await storage.get_all()
+        self.assertEqual(data, [{'id': 2, 'x': 123}])
+        object_id = await storage.create({'y': 123})
+        self.assertIsNotNone(object_id)
+        data = await storage.get_all()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(data[1], {'id': object_id, 'y': 123})
+        await storage.delete(object_id)
+        data = await storage.get_all()
+        self.assertEqual(data, [{'id': 2, 'x': 123}])
+        await storage.save({'id': 2, 'x': 123, 'z': 'xxx'})
+        object_data = await storage.get(2)
+        self.assertEqual(object_data, {'id': 2, 'x': 123, 'z': 'xxx'})
+        await storage.close()
+        with self.assertRaises(Exception):
+            await storage.get(2)
+
+    async def test_shared_connection(self):
+        users = AsyncStorage('users', self.config)
+        updates = AsyncStorage('updates', self.config)
+        await users.create({'id': 1})
+        with self.assertRaises(sqlite3.IntegrityError):
+            await users.create({'id': 1})
+        await asyncio.gather(
+            *(users.create({'id': object_id}) for object_id in range(2, 22)),
+            *(updates.create({'n': n}) for n in range(20)),
+        )
+        self.assertIs(users.provider._connection, updates.provider._connection)
+        self.assertEqual(len(await users.get_all()), 21)
+        self.assertEqual(len(await updates.get_all()), 20)
+        await users.close()
+        self.assertEqual(len(await updates.get_all()), 20)
+        await updates.close()
+
+    def test_sync_provider(self):
+        config = dict(self.config, provider='evernotebot.storage.providers.sqlite.Sqlite')
+        self.assertRaises(Exception, lambda: AsyncStorage('test', config))
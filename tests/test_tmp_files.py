@@ -0,0 +1,49 @@
+import os
+import tempfile
+from time import time
+from unittest import TestCase
+
+from evernotebot.util.tmp import TmpFileManager
+
+
+def make_file(path, size, age=0):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    mtime = time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestTmpFileManager(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = self.tmp_dir.name
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_scope(self):
+        manager = TmpFileManager(self.root)
+        scope = manager.scope()
+        path = make_file(scope.path('photo.jpg'), 100)
+        self.assertTrue(path.startswith(self.root))
+        self.assertIn(path, manager.active)
+        scope.cleanup()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(manager.stats['removed_bytes'], 100)
+        self.assertEqual(manager.stats['active_files'], 0)
+
+    def test_sweep(self):
+        manager = TmpFileManager(self.root, max_age=60, max_size=250)
+        old = make_file(os.path.join(self.root, 'old'), 10, age=120)
+        older = make_file(os.path.join(self.root, 'older'), 100, age=50)
+        new = make_file(os.path.join(self.root, 'new'), 100, age=10)
+        active = make_file(manager.scope().path('active'), 100, age=1000)
+        manager.sweep()
+        # `old` is expired, `older` is removed to fit in `max_size`, `active` is in use
+        self.assertEqual(sorted(os.listdir(self.root)), sorted(map(os.path.basename, (new, active))))
+        self.assertFalse(os.path.exists(old) or os.path.exists(older))
+        stats = manager.stats
+        self.assertEqual(stats['swept_files'], 2)
+        self.assertEqual(stats['files'], 2)
+        self.assertEqual(stats['size'], 200)
@@ -0,0 +1,68 @@
+import asyncio
+import os
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot import EvernoteBot
+from evernotebot.config import load_config
+
+
+class SlowBotApi:
+    def __init__(self):
+        self.messages = []
+
+    async def sendMessage(self, chat_id, text, reply_markup=None, parse_mode=None):
+        await asyncio.sleep(0.01)
+        self.messages.append(chat_id)
+        return {'message_id': len(self.messages)}
+
+    async def close(self):
+        pass
+
+
+def switch_mode_command(user_id: int, chat_id: int) -> dict:
+    return {
+        'update_id': user_id,
+        'message': {
+            'message_id': 1,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'},
+            'chat': {'id': chat_id},
+            'text': '/switch_mode',
+            'entities': [{'offset': 0, 'length': 12, 'type': 'bot_command'}],
+        },
+    }
+
+
+class TestUpdateContext(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        config = load_config()
+        config['storage'] = {
+            'provider': 'evernotebot.storage.providers.sqlite.AsyncSqlite',
+            'dirpath': '/tmp',  # nosec
+            'db_name': 'test_update_context',
+        }
+        self.db_path = Path('/tmp', 'test_update_context.sqlite')  # nosec
+        self.bot = EvernoteBot(config)
+        self.bot.api = SlowBotApi()
+
+    async def asyncTearDown(self) -> None:
+        await self.bot.stop()
+        if self.db_path.exists():
+            os.unlink(self.db_path)
+
+    async def test_concurrent_updates(self):
+        user_ids = range(1, 21)
+        for user_id in user_ids:
+            await self.bot._users.create({
+                'id': user_id,
+                'user_id': user_id,
+                'chat_id': user_id * 10,
+                'created': 1,
+                'bot_mode': 'multiple_notes',
+            })
+        updates = [switch_mode_command(user_id, chat_id=user_id * 10) for user_id in user_ids]
+        await asyncio.gather(*(self.bot.process_update(update) for update in updates))
+        self.assertEqual(sorted(self.bot.api.messages), [user_id * 10 for user_id in user_ids])
+        for user_id in user_ids:
+            user = await self.bot._users.get(user_id)
+            self.assertEqual(user.get('state'), 'switch_mode')
@@ -0,0 +1,53 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from evernotebot.bot.queue import UpdateQueue, UpdateQueueFull
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {'update_id': update_id, 'message': {'chat': {'id': chat_id}}}
+
+
+class TestUpdateQueue(IsolatedAsyncioTestCase):
+    async def test_chat_order(self):
+        processed = []
+
+        async def handler(update):
+            await asyncio.sleep(0.001 * (update['update_id'] % 3))
+            processed.append(update['update_id'])
+
+        queue = UpdateQueue(handler, workers=4)
+        for update_id in range(30):
+            queue.put(make_update(update_id, chat_id=update_id % 2))
+        await queue.stop()
+        self.assertEqual(sorted(processed), list(range(30)))
+        for chat_id in (0, 1):
+            chat_updates = [x for x in processed if x % 2 == chat_id]
+            self.assertEqual(chat_updates, sorted(chat_updates))
+        self.assertEqual(queue.stats['processed'], 30)
+        self.assertEqual(queue.stats['depth'], 0)
+
+    async def test_backpressure(self):
+        event = asyncio.Event()
+
+        async def handler(update):
+            await event.wait()
+
+        queue = UpdateQueue(handler, workers=2, max_size=2)
+        queue.put(make_update(1, 1))
+        queue.put(make_update(2, 2))
+        with self.assertRaises(UpdateQueueFull):
+            queue.put(make_update(3, 3))
+        self.assertEqual(queue.stats['rejected'], 1)
+        event.set()
+        await queue.stop()
+        self.assertEqual(queue.stats['processed'], 2)
+
+    async def test_handler_error(self):
+        async def handler(update):
+            raise Exception('failed')
+
+        queue = UpdateQueue(handler)
+        queue.put(make_update(1, 1))
+        await queue.stop()
+        self.assertEqual(queue.stats['failed'], 1)
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import signal
+import tempfile
+from time import time
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from evernotebot.bot.workers import WorkerPool, pick_worker
+from evernotebot.config import load_config
+from tests.telegram.fake_bot_api import FakeBotApi
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User', 'last_name': str(chat_id)},
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time()),
+            'text': 'text',
+        },
+    }
+
+
+class TestRendezvousHashing(TestCase):
+    def test_pick_worker(self):
+        keys = range(1000)
+        owners = {key: pick_worker(key, [0, 1, 2, 3]) for key in keys}
+        self.assertTrue(all(150 < list(owners.values()).count(index) < 350 for index in range(4)))
+        for key in keys:
+            owner = pick_worker(key, [0, 1, 3])
+            if owners[key] != 2:
+                self.assertEqual(owner, owners[key])  # only chats of the removed worker move
+
+
+class TestWorkerPool(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.bot_api = FakeBotApi()
+        await self.bot_api.start()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        environ = {
+            'TELEGRAM_API_TOKEN': 'token',
+            'BOT_API_URL': self.bot_api.url,
+            'TMP_ROOT': os.path.join(self.tmp_dir.name, 'tmp'),
+            'EVERNOTEBOT_STORAGE_PROVIDER': 'evernotebot.storage.providers.sqlite.AsyncSqlite',
+            'EVERNOTEBOT_STORAGE_DIR': os.path.join(self.tmp_dir.name, 'storage'),
+        }
+        self.environ = dict(os.environ)
+        os.environ.update(environ)
+        config = load_config()
+        config['queue']['workers'] = 4
+        self.pool = WorkerPool(config, processes=2, restart_delay=0.1, metrics_interval=0.1)
+
+    async def asyncTearDown(self) -> None:
+        await self.pool.stop()
+        await self.bot_api.stop()
+        self.tmp_dir.cleanup()
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    async def test_process_updates(self):
+        await self.pool.start()
+        updates = [make_update(update_id, chat_id=update_id % 10) for update_id in range(1, 41)]
+        await asyncio.gather(*(self.pool.process_update(update) for update in updates))
+        # Messages of unregistered users are answered by an error
+        self.assertEqual(self.bot_api.error_messages, 40)
+        workers = self.pool.stats['workers']
+        self.assertEqual(sum(worker['processed'] for worker in workers), 40)
+        self.assertTrue(all(worker['processed'] for worker in workers))
+        self.assertEqual(self.pool.stats['chats'], 0)
+        await asyncio.sleep(0.2)
+        for index, families in self.pool.metrics.items():
+            updates_total = next(family for family in families if family['name'] == 'evernotebot_updates_total')
+            self.assertEqual(updates_total['samples'], [('evernotebot_updates_total', {'result': 'error'},
+                                                         workers[index]['processed'])])
+
+        os.kill(workers[0]['pid'], signal.SIGKILL)
+        await asyncio.sleep(0.05)
+        updates = [make_update(update_id, chat_id=update_id % 10) for update_id in range(41, 61)]
+        await asyncio.gather(*(self.pool.process_update(update) for update in updates))
+        self.assertEqual(self.bot_api.error_messages, 60)
+        for _ in range(300):
+            worker = self.pool.stats['workers'][0]
+            if worker['alive'] and worker['ready']:
+                break
+            await asyncio.sleep(0.1)
+        self.assertEqual(worker['restarts'], 1)
+        self.assertNotEqual(worker['pid'], workers[0]['pid'])